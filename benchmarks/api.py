@@ -0,0 +1,240 @@
+"""Latency and throughput benchmark for the users API
+
+Seeds the database of the chosen config with --users rows, then drives each
+endpoint with --concurrency threads and prints p50/p95/p99 latency,
+throughput and (in-process only) SQL queries per request as JSON. Compare
+the output of two commits to spot regressions.
+
+In-process mode (the default) goes through the Flask test client, so it
+measures the app without any network or server in between:
+
+    $ APP_SETTINGS=project.config.TestingConfig \\
+        python benchmarks/api.py --users 100000 --concurrency 8
+
+Live mode sends real HTTP requests to a running server, which must use the
+same database so the seeded user can log in, and RATELIMIT_ENABLED=0:
+
+    $ python benchmarks/api.py --live http://localhost:5000
+
+The seeding drops and recreates every table, so never point it at a
+database you care about.
+"""
+import argparse
+import datetime
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.dialects.postgresql import insert  # noqa: E402
+
+from project import create_app, db  # noqa: E402
+from project.api.instrumentation import count_queries  # noqa: E402
+from project.api.models import User  # noqa: E402
+
+ENDPOINTS = ('ping', 'register', 'login', 'status', 'users', 'user')
+
+BENCH_EMAIL = 'bench@example.com'
+BENCH_PASSWORD = 'benchpass'
+
+
+def seed(app, count, chunk_size=5000):
+    """Recreates the tables and inserts `count` users plus the bench user"""
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        # one hash for everybody; hashing a million passwords is not the point
+        pw_hash = User(
+            username='seed', email='seed@example.com', password=BENCH_PASSWORD
+        ).password
+        start = datetime.datetime.utcnow() - datetime.timedelta(days=365)
+        rows = ({
+            'username': f'user{i}',
+            'email': f'user{i}@example.com',
+            'password': pw_hash,
+            'created_at': start + datetime.timedelta(seconds=i)
+        } for i in range(count))
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            db.session.execute(insert(User.__table__).values(chunk))
+            db.session.commit()
+        db.session.execute(insert(User.__table__).values(
+            username='bench', email=BENCH_EMAIL, password=pw_hash,
+            created_at=datetime.datetime.utcnow()))
+        db.session.commit()
+        db.session.execute('ANALYZE users')
+        db.session.commit()
+
+
+class InProcessClient:
+    """Test client per thread, returning (status, body) like a server"""
+
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+
+    def request(self, method, path, body=None, headers=None):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        response = client.open(
+            path, method=method, headers=headers or {},
+            data=json.dumps(body) if body is not None else None,
+            content_type='application/json')
+        return response.status_code, response.data
+
+
+class LiveClient:
+    """Plain HTTP against a running server"""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {}, **{'Content-Type': 'application/json'})
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(
+            self.url + path, data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(req) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+def make_scenarios(client, user_count):
+    """One callable per endpoint, returning (status, expected status)"""
+    status, body = client.request(
+        'POST', '/auth/login',
+        {'email': BENCH_EMAIL, 'password': BENCH_PASSWORD})
+    if status != 200:
+        raise SystemExit(f'could not log in the bench user ({status})')
+    headers = {
+        'Authorization': 'Bearer ' + json.loads(body.decode())['auth_token']}
+    counter = itertools.count()
+    run_id = int(time.time())
+
+    def register():
+        n = next(counter)
+        return client.request('POST', '/auth/register', {
+            'username': f'bench-{run_id}-{n}',
+            'email': f'bench-{run_id}-{n}@example.com',
+            'password': BENCH_PASSWORD
+        })[0], 201
+
+    return {
+        'ping': lambda: (client.request('GET', '/ping')[0], 200),
+        'register': register,
+        'login': lambda: (client.request('POST', '/auth/login', {
+            'email': BENCH_EMAIL, 'password': BENCH_PASSWORD})[0], 200),
+        'status': lambda: (client.request(
+            'GET', '/auth/status', headers=headers)[0], 200),
+        'users': lambda: (client.request('GET', '/users')[0], 200),
+        'user': lambda: (client.request(
+            'GET', f'/users/{random.randint(1, user_count)}')[0], 200)
+    }
+
+
+def percentile(samples, pct):
+    index = max(0, int(round(pct / 100 * len(samples))) - 1)
+    return samples[index]
+
+
+def run(scenario, requests, concurrency):
+    """Runs `requests` calls over `concurrency` threads"""
+    latencies = []
+    errors = []
+
+    def call(_):
+        start = time.perf_counter()
+        status, expected = scenario()
+        latencies.append(time.perf_counter() - start)
+        if status != expected:
+            errors.append(status)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(call, range(requests)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'requests': requests,
+        'errors': len(errors),
+        'throughput_rps': round(requests / elapsed, 1),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 3),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument(
+        '--endpoints', default=','.join(ENDPOINTS),
+        help='comma separated subset of ' + ', '.join(ENDPOINTS))
+    parser.add_argument(
+        '--rounds', type=int, help='override BCRYPT_LOG_ROUNDS')
+    parser.add_argument(
+        '--live', metavar='URL', help='benchmark a running server instead')
+    parser.add_argument(
+        '--no-seed', action='store_true', help='reuse the seeded database')
+    parser.add_argument('--output', help='write the JSON report here too')
+    args = parser.parse_args()
+
+    app = create_app()
+    # tokens must outlive the run, and the seeded hashes use these rounds
+    app.config['ACCESS_TOKEN_EXPIRATION_SECONDS'] = 3600
+    app.config['TOKEN_EXPIRATION_DAYS'] = 1
+    # one client hammering login is exactly what the rate limiter stops
+    app.config['RATELIMIT_ENABLED'] = False
+    if args.rounds:
+        app.config['BCRYPT_LOG_ROUNDS'] = args.rounds
+    if not args.no_seed:
+        seed(app, args.users)
+
+    if args.live:
+        client = LiveClient(args.live)
+    else:
+        client = InProcessClient(app)
+
+    scenarios = make_scenarios(client, args.users)
+    results = {}
+    for name in args.endpoints.split(','):
+        with count_queries() as queries:
+            results[name] = run(
+                scenarios[name], args.requests, args.concurrency)
+        if not args.live:
+            results[name]['queries_per_request'] = round(
+                queries.count / args.requests, 2)
+
+    report = {
+        'mode': 'live' if args.live else 'in-process',
+        'users': args.users,
+        'concurrency': args.concurrency,
+        'bcrypt_rounds': app.config['BCRYPT_LOG_ROUNDS'],
+        'endpoints': results
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
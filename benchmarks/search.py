@@ -0,0 +1,145 @@
+"""Latency of GET /users/search on a large table
+
+Fills the users table of the chosen config with --users rows in one
+INSERT ... SELECT, adds the pg_trgm indexes of the search migration, then
+times a mix of search terms through the Flask test client and prints
+p50/p95/p99 per term as JSON, together with whether Postgres planned the
+query on the trigram indexes:
+
+    $ APP_SETTINGS=project.config.TestingConfig \\
+        python benchmarks/search.py --users 2000000
+
+Seeding a few million rows takes minutes; pass --no-seed to reuse them.
+The seeding drops and recreates every table, so never point it at a
+database you care about.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from project import create_app, db  # noqa: E402
+
+# username prefix, email prefix, substring, rare substring, no match, then
+# terms matching (nearly) every row: a prefix of every username and a
+# substring of every email
+TERMS = (
+    'user1234', 'mail98765', 'a3f9', '5e7c1', 'nobody-matches', 'user', 'exam')
+
+SEED = """
+INSERT INTO users (username, email, password, active, admin, created_at)
+SELECT 'user' || i || '_' || substr(md5(i::text), 1, 6),
+       'mail' || i || '.' || substr(md5(i::text), 7, 6) || '@example.com',
+       'x', true, false,
+       now() - i * interval '1 second'
+FROM generate_series(1, :count) AS i
+"""
+
+TRGM_INDEXES = (
+    'CREATE INDEX ix_users_username_trgm ON users '
+    'USING gin (username gin_trgm_ops)',
+    'CREATE INDEX ix_users_email_trgm ON users '
+    'USING gin (email gin_trgm_ops)'
+)
+
+
+def seed(app, count):
+    """Recreates the tables with `count` users and the search indexes"""
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.execute(SEED, {'count': count})
+        db.session.commit()
+        try:
+            db.session.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        except Exception as e:
+            db.session.rollback()
+            print(f'pg_trgm unavailable, timing without it: {e}',
+                  file=sys.stderr)
+        else:
+            for statement in TRGM_INDEXES:
+                db.session.execute(statement)
+        db.session.commit()
+        db.session.execute('ANALYZE users')
+        db.session.commit()
+
+
+def uses_trigram_index(app, term):
+    """Whether the plan of any search query reads a trigram index"""
+    queries = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if 'rank' in statement:
+            queries.append(cursor.mogrify(statement, parameters).decode())
+
+    with app.app_context():
+        db.event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            app.test_client().get(f'/users/search?q={term}')
+        finally:
+            db.event.remove(db.engine, 'before_cursor_execute', capture)
+        # a plain DBAPI cursor, so the % of the LIKE patterns stay as they are
+        connection = db.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            plans = []
+            # one query per rank read
+            for query in queries:
+                cursor.execute('EXPLAIN ' + query)
+                plans.extend(row[0] for row in cursor.fetchall())
+            return any('_trgm' in line for line in plans)
+        finally:
+            connection.close()
+
+
+def percentile(samples, pct):
+    index = max(0, int(round(pct / 100 * len(samples))) - 1)
+    return samples[index]
+
+
+def time_term(client, term, requests):
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = client.get(f'/users/search?q={term}&fields=id,username')
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise SystemExit(f'search for {term!r} failed: {response.data}')
+    latencies.sort()
+    return {
+        'results': len(json.loads(response.data.decode())['data']['users']),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 3),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000000)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument(
+        '--terms', default=','.join(TERMS), help='comma separated')
+    parser.add_argument(
+        '--no-seed', action='store_true', help='reuse the seeded database')
+    args = parser.parse_args()
+
+    app = create_app()
+    if not args.no_seed:
+        seed(app, args.users)
+    client = app.test_client()
+    results = {}
+    for term in args.terms.split(','):
+        client.get(f'/users/search?q={term}')  # warm the cache
+        results[term] = time_term(client, term, args.requests)
+        results[term]['trigram_index'] = uses_trigram_index(app, term)
+    print(json.dumps({'users': args.users, 'terms': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""CPU cost of serializing a large GET /users response
+
+Builds --users in-memory rows shaped like the query rows of GET /users and
+times turning them into a jsonify response three ways, printing the mean
+and p50 in milliseconds per payload as JSON:
+
+- `baseline`: dicts built field by field and Flask's default encoder,
+  the path every view took before the serialization layer;
+- `stdlib`: USER_SCHEMA.dump_many and FastJSONEncoder without orjson;
+- `fast`: the same with orjson, when it is installed.
+
+    $ APP_SETTINGS=project.config.TestingConfig \\
+        python benchmarks/serialization.py --users 10000
+
+No database is needed. Pass --pretty to time the indented output Flask
+0.12 sends to clients that are not XHR.
+"""
+import argparse
+import datetime
+import json
+import os
+import statistics
+import sys
+import time
+from collections import namedtuple
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import jsonify  # noqa: E402
+from flask.json import JSONEncoder  # noqa: E402
+
+from project import create_app  # noqa: E402
+from project.api import serialization  # noqa: E402
+from project.api.serialization import (  # noqa: E402
+    FastJSONEncoder, USER_SCHEMA)
+
+Row = namedtuple('Row', USER_SCHEMA.fields)
+
+
+def make_rows(count):
+    created_at = datetime.datetime.utcnow()
+    return [
+        Row(i, f'user{i}', f'user{i}@example.com',
+            created_at - datetime.timedelta(seconds=i))
+        for i in range(count, 0, -1)
+    ]
+
+
+def baseline(rows):
+    fields = USER_SCHEMA.fields
+    users = [{field: getattr(row, field) for field in fields} for row in rows]
+    return jsonify({'status': 'success', 'data': {'users': users}})
+
+
+def schema(rows):
+    users = USER_SCHEMA.dump_many(rows)
+    return jsonify({'status': 'success', 'data': {'users': users}})
+
+
+def time_path(app, path, rows, encoder, repeat, orjson):
+    app.json_encoder = encoder
+    timings = []
+    headers = {} if app.config['JSONIFY_PRETTYPRINT_REGULAR'] else {
+        'X-Requested-With': 'XMLHttpRequest'}
+    with app.test_request_context('/users', headers=headers), \
+            mock.patch.object(serialization, 'orjson', orjson):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            response = path(rows)
+            timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        'bytes': len(response.data),
+        'mean_ms': round(statistics.mean(timings) * 1000, 3),
+        'p50_ms': round(timings[len(timings) // 2] * 1000, 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument(
+        '--pretty', action='store_true', help='time indented output')
+    args = parser.parse_args()
+
+    app = create_app()
+    app.config['JSONIFY_PRETTYPRINT_REGULAR'] = args.pretty
+    rows = make_rows(args.users)
+    results = {
+        'baseline': time_path(
+            app, baseline, rows, JSONEncoder, args.repeat,
+            serialization.orjson),
+        'stdlib': time_path(
+            app, schema, rows, FastJSONEncoder, args.repeat, None)
+    }
+    if serialization.orjson is not None:
+        results['fast'] = time_path(
+            app, schema, rows, FastJSONEncoder, args.repeat,
+            serialization.orjson)
+    for name, result in results.items():
+        result['speedup'] = round(
+            results['baseline']['mean_ms'] / result['mean_ms'], 2)
+    print(json.dumps({'users': args.users, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Startup time of the CLI and of the app
+
+Times `python manage.py --help` and a bare `create_app()` in fresh
+interpreters, and prints the results as JSON. Pass a git revision to time
+that revision too (from a temporary worktree) and compare the two:
+
+    $ python benchmarks/startup.py --runs 10 --ref HEAD~1
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BOOT = (
+    'import time; start = time.perf_counter(); '
+    'from project import create_app; create_app(); '
+    'print(time.perf_counter() - start)'
+)
+
+
+def time_command(args, cwd):
+    start = time.perf_counter()
+    subprocess.run(
+        args, cwd=cwd, check=True,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def time_boot(cwd):
+    out = subprocess.run(
+        [sys.executable, '-c', BOOT], cwd=cwd, check=True,
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    return float(out.stdout.decode().strip().splitlines()[-1])
+
+
+def summarize(samples):
+    return {
+        'min_ms': round(min(samples) * 1000, 2),
+        'median_ms': round(statistics.median(samples) * 1000, 2),
+        'max_ms': round(max(samples) * 1000, 2)
+    }
+
+
+def measure(cwd, runs):
+    manage_help = [
+        time_command([sys.executable, 'manage.py', '--help'], cwd)
+        for _ in range(runs)]
+    boot = [time_boot(cwd) for _ in range(runs)]
+    return {
+        'manage_help': summarize(manage_help),
+        'create_app': summarize(boot)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument(
+        '--ref', help='git revision to compare against, e.g. HEAD~1')
+    args = parser.parse_args()
+    report = {'runs': args.runs, 'current': measure(ROOT, args.runs)}
+    if args.ref:
+        worktree = tempfile.mkdtemp(prefix='startup-bench-')
+        try:
+            subprocess.run(
+                ['git', 'worktree', 'add', '--detach', worktree, args.ref],
+                cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+            report[args.ref] = measure(worktree, args.runs)
+        finally:
+            subprocess.run(
+                ['git', 'worktree', 'remove', '--force', worktree],
+                cwd=ROOT, stdout=subprocess.DEVNULL)
+            shutil.rmtree(worktree, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
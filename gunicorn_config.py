@@ -0,0 +1,60 @@
+"""Gunicorn settings for the users service
+
+Workers and threads are sized from the CPU count; every value can be
+overridden through the environment.
+
+    $ gunicorn -c gunicorn_config.py wsgi:app
+"""
+import multiprocessing
+import os
+import shutil
+
+
+cpus = multiprocessing.cpu_count()
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+# sync, gthread or gevent
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('WEB_CONCURRENCY', cpus * 2 + 1))
+threads = int(os.environ.get(
+    'GUNICORN_THREADS', 4 if worker_class == 'gthread' else 1))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+# gevent has to patch a worker before the app is imported, so no preload
+preload_app = os.environ.get(
+    'GUNICORN_PRELOAD', '0' if worker_class == 'gevent' else '1') == '1'
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 1000))
+accesslog = os.environ.get('GUNICORN_ACCESSLOG', '-')
+
+# read by project.config to split DB_MAX_CONNECTIONS and the bcrypt processes
+# (BCRYPT_MAX_PROCESSES, one per CPU) between workers
+os.environ.setdefault('WEB_CONCURRENCY', str(workers))
+if worker_class == 'gevent':
+    os.environ.setdefault(
+        'BCRYPT_EXECUTOR', 'gevent.threadpool.ThreadPoolExecutor')
+# per-worker metric files merged by /metrics; has to exist before the app is
+# imported, and samples left by a previous master must not be merged in
+metrics_dir = os.environ.setdefault(
+    'prometheus_multiproc_dir', '/tmp/prometheus_multiproc')
+shutil.rmtree(metrics_dir, ignore_errors=True)
+os.makedirs(metrics_dir)
+
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    if preload_app:
+        # never share connections the master may have opened before fork
+        from project import db
+        from wsgi import app
+        with app.app_context():
+            db.engine.dispose()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,27 +1,33 @@
 #!/usr/bin/python3.5
-import unittest
-import coverage
+import sys
+
+COV = None
+if sys.argv[1:2] == ['cov']:
+    # only `cov` runs under the tracer; it starts before the project is
+    # imported so module level code is measured too
+    import coverage
+    COV = coverage.coverage(
+        branch=True,
+        include='project/*',
+        omit=[
+            'project/tests/*',
+            'project/server/config.py',
+            'project/server/*/__init__.py'
+        ]
+    )
+    COV.start()
 
 from flask_script import Manager
 from flask_migrate import MigrateCommand
 
-from project import create_app, db
-from project.api.models import User
 
-COV = coverage.coverage(
-    branch=True,
-    include='project/*',
-    omit=[
-        'project/tests/*',
-        'project/server/config.py',
-        'project/server/*/__init__.py'
-    ]
-)
-COV.start()
+def create_app():
+    """Builds the app only once a command actually needs it"""
+    from project import create_app
+    return create_app()
 
 
-app = create_app()
-manager = Manager(app)
+manager = Manager(create_app)
 
 # custom command
 manager.add_command('db', MigrateCommand)
@@ -30,6 +36,7 @@ manager.add_command('db', MigrateCommand)
 @manager.command
 def test():
     """Run the tests without code coverage"""
+    import unittest
     tests = unittest.TestLoader().discover('project/tests', pattern='test*.py')
     result = unittest.TextTestRunner(verbosity=2).run(tests)
     if result.wasSuccessful():
@@ -40,6 +47,7 @@ def test():
 @manager.command
 def cov():
     """Runs the unit tests with coverage."""
+    import unittest
     tests = unittest.TestLoader().discover('project/tests/')
     result = unittest.TextTestRunner(verbosity=2).run(tests)
     if result.wasSuccessful():
@@ -53,9 +61,45 @@ def cov():
     return 1
 
 
+@manager.option('-t', '--target-ms', dest='target_ms', type=float, default=250,
+                help='login latency budget for one bcrypt check')
+@manager.option('-s', '--samples', dest='samples', type=int, default=5)
+def bcrypt_rounds(target_ms, samples):
+    """Benchmarks bcrypt costs on this host and recommends one"""
+    import statistics
+    import time
+    import bcrypt
+    from flask import current_app
+    password = b'correct horse battery staple'
+    recommended = None
+    print('rounds  median ms')
+    for rounds in range(4, 32):
+        pw_hash = bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+        timings = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            bcrypt.checkpw(password, pw_hash)
+            timings.append((time.perf_counter() - start) * 1000)
+        median = statistics.median(timings)
+        print(f'{rounds:>6}  {median:>9.1f}')
+        if median > target_ms:
+            break
+        recommended = rounds
+    current = current_app.config.get('BCRYPT_LOG_ROUNDS')
+    if recommended is None:
+        print(f'Even 4 rounds exceed {target_ms:g} ms on this host.')
+        return 1
+    print(f'Recommended BCRYPT_LOG_ROUNDS: {recommended} '
+          f'(currently {current}) for a {target_ms:g} ms budget.')
+    if recommended != current:
+        print('Existing hashes move to the new cost as their users log in.')
+    return 0
+
+
 @manager.command
 def recreate_db():
     """Recreates a database"""
+    from project import db
     db.drop_all()
     db.create_all()
     db.session.commit()
@@ -64,6 +108,8 @@ def recreate_db():
 @manager.command
 def seed_db():
     """Seeds the database."""
+    from project import db
+    from project.api.models import User
     db.session.add(User(
             username='edi',
             email='edi@repodevs.com',
@@ -0,0 +1,24 @@
+"""users created_at id index
+
+Revision ID: 4b2e7f9a1c3d
+Revises: e8df9ee82a6c
+Create Date: 2026-10-18 09:12:41.530187
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '4b2e7f9a1c3d'
+down_revision = 'e8df9ee82a6c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        'ix_users_created_at_id', 'users', ['created_at', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_users_created_at_id', table_name='users')
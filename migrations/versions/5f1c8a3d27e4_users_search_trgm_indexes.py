@@ -0,0 +1,34 @@
+"""users search trgm indexes
+
+Revision ID: 5f1c8a3d27e4
+Revises: c7e3b1f05a92
+Create Date: 2026-10-18 15:42:09.518204
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5f1c8a3d27e4'
+down_revision = 'c7e3b1f05a92'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # GIN trigram indexes answer ILIKE '%q%' as well as ILIKE 'q%'; they are
+    # not declared on the model because create_all can not add the extension
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index(
+        'ix_users_username_trgm', 'users', ['username'],
+        postgresql_using='gin',
+        postgresql_ops={'username': 'gin_trgm_ops'})
+    op.create_index(
+        'ix_users_email_trgm', 'users', ['email'],
+        postgresql_using='gin',
+        postgresql_ops={'email': 'gin_trgm_ops'})
+
+
+def downgrade():
+    op.drop_index('ix_users_email_trgm', table_name='users')
+    op.drop_index('ix_users_username_trgm', table_name='users')
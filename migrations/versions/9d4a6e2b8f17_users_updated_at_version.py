@@ -0,0 +1,30 @@
+"""users updated_at version
+
+Revision ID: 9d4a6e2b8f17
+Revises: 4b2e7f9a1c3d
+Create Date: 2026-10-18 10:02:15.214662
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d4a6e2b8f17'
+down_revision = '4b2e7f9a1c3d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column(
+        'updated_at', sa.DateTime(), nullable=False,
+        server_default=sa.text("(now() at time zone 'utc')")))
+    op.add_column('users', sa.Column(
+        'version', sa.Integer(), nullable=False, server_default='1'))
+    op.execute('UPDATE users SET updated_at = created_at')
+
+
+def downgrade():
+    op.drop_column('users', 'version')
+    op.drop_column('users', 'updated_at')
@@ -0,0 +1,38 @@
+"""revoked tokens
+
+Revision ID: a3d9e6c4b170
+Revises: 5f1c8a3d27e4
+Create Date: 2026-10-18 17:36:52.740193
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3d9e6c4b170'
+down_revision = '5f1c8a3d27e4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'revoked_tokens',
+        sa.Column('jti', sa.String(length=32), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.Column(
+            'revoked_at', sa.DateTime(), nullable=False,
+            server_default=sa.text("(now() at time zone 'utc')")),
+        sa.PrimaryKeyConstraint('jti')
+    )
+    op.create_index(
+        'ix_revoked_tokens_expires_at', 'revoked_tokens', ['expires_at'])
+    op.create_index(
+        'ix_revoked_tokens_revoked_at', 'revoked_tokens', ['revoked_at'])
+
+
+def downgrade():
+    op.drop_index('ix_revoked_tokens_revoked_at', table_name='revoked_tokens')
+    op.drop_index('ix_revoked_tokens_expires_at', table_name='revoked_tokens')
+    op.drop_table('revoked_tokens')
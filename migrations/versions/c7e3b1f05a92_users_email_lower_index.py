@@ -0,0 +1,28 @@
+"""users email lower index
+
+Revision ID: c7e3b1f05a92
+Revises: 9d4a6e2b8f17
+Create Date: 2026-10-18 11:20:47.903318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7e3b1f05a92'
+down_revision = '9d4a6e2b8f17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # fails on emails that only differ by case, which need merging by hand
+    op.execute('UPDATE users SET email = lower(trim(email))')
+    op.create_index(
+        'ix_users_email_lower', 'users', [sa.text('lower(email)')],
+        unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_users_email_lower', table_name='users')
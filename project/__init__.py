@@ -1,15 +1,51 @@
 import os
 from flask import Flask, jsonify
-from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy import SQLAlchemy as _SQLAlchemy
 from flask_cors import CORS
 from flask_migrate import Migrate
 from flask_bcrypt import Bcrypt
+from werkzeug.utils import import_string
+
+from project.api.cache import Cache
+from project.api.hashing import PasswordHasher, HashingUnavailable
+from project.api.pool import InstrumentedQueuePool, InstrumentedNullPool
+from project.api.instrumentation import QueryInstrumentation
+from project.api.ratelimit import RateLimiter
+from project.api.revocation import RevocationList
+from project.api.keys import KeyRing
+
+
+class SQLAlchemy(_SQLAlchemy):
+    """Flask-SQLAlchemy with pre-ping, statement timeout and pool metrics"""
+
+    def apply_driver_hacks(self, app, info, options):
+        super().apply_driver_hacks(app, info, options)
+        if app.config.get('SQLALCHEMY_POOL_PRE_PING'):
+            options['pool_pre_ping'] = True
+        statement_timeout = app.config.get('SQLALCHEMY_STATEMENT_TIMEOUT')
+        if statement_timeout and info.drivername.startswith('postgres'):
+            options.setdefault('connect_args', {})['options'] = (
+                f'-c statement_timeout={statement_timeout}')
+        if app.config.get('SQLALCHEMY_EXTERNAL_POOLER'):
+            # PgBouncer owns the pooling, so hold nothing between checkouts
+            options['poolclass'] = InstrumentedNullPool
+            for key in ('pool_size', 'pool_timeout', 'max_overflow'):
+                options.pop(key, None)
+        else:
+            options.setdefault('poolclass', InstrumentedQueuePool)
 
 
 # instance the extensions
 db = SQLAlchemy()
 migrate = Migrate()
 bcrypt = Bcrypt()
+principal_cache = Cache('PRINCIPAL_CACHE')
+token_cache = Cache('TOKEN_CACHE')
+hasher = PasswordHasher()
+sql_instrumentation = QueryInstrumentation()
+limiter = RateLimiter()
+revocations = RevocationList()
+keyring = KeyRing()
 
 
 def create_app():
@@ -21,17 +57,38 @@ def create_app():
     # set configuration
     app_settings = os.getenv('APP_SETTINGS')
     app.config.from_object(app_settings)
+    app.json_encoder = import_string(app.config.get('JSON_ENCODER'))
 
     # setup extensions
     db.init_app(app)
+    sql_instrumentation.init_app(app)
     bcrypt.init_app(app)
     migrate.init_app(app, db)
+    principal_cache.init_app(app)
+    token_cache.init_app(app)
+    hasher.init_app(app)
+    limiter.init_app(app)
+    revocations.init_app(app)
+    keyring.init_app(app)
 
     # registers blueprints
     from project.api.users import users_blueprint
     from project.api.auth import auth_blueprint
+    from project.api.metrics import metrics_blueprint
     app.register_blueprint(auth_blueprint)
     app.register_blueprint(users_blueprint)
+    app.register_blueprint(metrics_blueprint)
+
+    # shed password work instead of queueing it when bcrypt is saturated
+    @app.errorhandler(HashingUnavailable)
+    def hashing_unavailable(e):
+        response_object = {
+            'status': 'error',
+            'message': 'Server busy. Please try again later.'
+        }
+        return jsonify(response_object), 503, {
+            'Retry-After': str(hasher.retry_after)
+        }
 
     return app
 
@@ -1,17 +1,24 @@
 # -*- coding: utf-8 -*-
 
-from flask import Blueprint, jsonify, request
-from sqlalchemy import exc, or_
+import datetime
 
-from project.api.models import User
-from project.api.utils import authenticate
-from project import db, bcrypt
+from flask import Blueprint, current_app, g, jsonify, request
+from sqlalchemy import exc
+
+from project.api.models import RevokedToken, User
+from project.api.serialization import USER_STATUS_SCHEMA
+from project.api.utils import authenticate, get_current_user, is_admin
+from project import (
+	db, hasher, keyring, limiter, principal_cache, revocations, token_cache)
+from project.api.hashing import HashingUnavailable
+from project.api.pool import pool_stats
 
 
 auth_blueprint = Blueprint('auth', __name__)
 
 
 @auth_blueprint.route('/auth/register', methods=['POST'])
+@limiter.limit('register')
 def register_user():
 	# get post data
 	post_data = request.get_json()
@@ -25,26 +32,20 @@ def register_user():
 	email = post_data.get('email')
 	password = post_data.get('password')
 	try:
-		# check for existing user
-		user = User.query.filter(
-			or_(User.username == username, User.email == email)).first()
-		if not user:
-			new_user = User(
-				username=username,
-				email=email,
-				password=password
-			)
-			db.session.add(new_user)
+		user_id = User.insert_unique(username, email, password)
+		if user_id:
 			db.session.commit()
 			# generate auth token
-			auth_token = new_user.encode_auth_token(new_user.id)
+			auth_token, refresh_token = User.encode_session_tokens(user_id)
 			response_object = {
 				'status': 'success',
 				'message': 'Successfully registered.',
-				'auth_token': auth_token.decode()
+				'auth_token': auth_token.decode(),
+				'refresh_token': refresh_token.decode()
 			}
 			return jsonify(response_object), 201
 		else:
+			db.session.rollback()
 			response_object = {
 				'status': 'error',
 				'message': 'Sorry. That user already exists.'
@@ -60,6 +61,7 @@ def register_user():
 		return jsonify(response_object), 400
 
 @auth_blueprint.route('/auth/login', methods=['POST'])
+@limiter.limit('login')
 def login_user():
 	# get data post
 	post_data = request.get_json()
@@ -73,14 +75,22 @@ def login_user():
 	password = post_data.get('password')
 	try:
 		# fetch the user data
-		user = User.query.filter_by(email=email).first()
-		if user and bcrypt.check_password_hash(user.password, password):
-			auth_token = user.encode_auth_token(user.id)
+		user = User.by_email(email).first()
+		if user and hasher.check_password_hash(user.password, password):
+			auth_token, refresh_token = user.encode_session_tokens(
+				user.id, user.active, user.admin)
+			# bring hashes made at an older cost up to date, off the request
+			if hasher.needs_rehash(
+					user.password, current_app.config.get('BCRYPT_LOG_ROUNDS')):
+				hasher.defer(
+					rehash_password, current_app._get_current_object(),
+					user.id, user.password, password, key=user.id)
 			if auth_token:
 				response_object = {
 					'status': 'success',
 					'message': 'Successfully loged in.',
-					'auth_token': auth_token.decode()
+					'auth_token': auth_token.decode(),
+					'refresh_token': refresh_token.decode()
 				}
 				return jsonify(response_object), 200
 		else:
@@ -89,6 +99,8 @@ def login_user():
 				'message': 'User does not exist.'
 			}
 			return jsonify(response_object), 404
+	except HashingUnavailable:
+		raise
 	except Exception as e:
 		print(e)
 		response_object = {
@@ -97,9 +109,76 @@ def login_user():
 		}
 		return jsonify(response_object), 500
 
+def rehash_password(app, user_id, pw_hash, password):
+	with app.app_context():
+		try:
+			User.rehash_password(user_id, pw_hash, password)
+		except HashingUnavailable:
+			# logins come first; the next one of this user tries again
+			pass
+		except Exception:
+			db.session.rollback()
+			app.logger.exception('Could not rehash the password of %s', user_id)
+
+@auth_blueprint.route('/auth/refresh', methods=['POST'])
+def refresh_token():
+	"""Issues a new access token for a refresh token
+
+	The user is read from the database here, so deactivated users and
+	changed admin rights take effect at the next refresh.
+	"""
+	response_object = {
+		'status': 'error',
+		'message': 'Something went wrong. Please contact us.'
+	}
+	# "Bearer <token>"
+	parts = request.headers.get('Authorization', '').split()
+	if len(parts) != 2:
+		response_object['message'] = 'Provide a valid refresh token.'
+		return jsonify(response_object), 403
+	payload = User.decode_auth_payload(parts[1], 'refresh')
+	if isinstance(payload, str):
+		response_object['message'] = payload
+		return jsonify(response_object), 401
+	user = User.query.filter_by(id=payload['sub']).first()
+	if not user or not user.active:
+		return jsonify(response_object), 401
+	auth_token = user.encode_auth_token(
+		user.id, user.active, user.admin, payload.get('jti'))
+	response_object = {
+		'status': 'success',
+		'message': 'Successfully refreshed.',
+		'auth_token': auth_token.decode()
+	}
+	return jsonify(response_object), 200
+
+@auth_blueprint.route('/.well-known/jwks.json', methods=['GET'])
+def get_jwks():
+	"""Public keys other services verify our tokens with, without calling us"""
+	response = jsonify(keyring.jwks)
+	response.set_etag(keyring.jwks_etag)
+	response.cache_control.public = True
+	response.cache_control.max_age = current_app.config.get('JWKS_MAX_AGE')
+	return response.make_conditional(request)
+
 @auth_blueprint.route('/auth/logout', methods=['GET'])
 @authenticate
 def logout_user(resp):
+	"""Revokes the access token and, through its session, the refresh token"""
+	payload = g.token_payload
+	refresh_expires_at = datetime.datetime.utcnow() + datetime.timedelta(
+		days=current_app.config.get('TOKEN_EXPIRATION_DAYS'),
+		seconds=current_app.config.get('TOKEN_EXPIRATION_SECONDS'))
+	revoked = [
+		(payload.get('jti'), datetime.datetime.utcfromtimestamp(payload['exp'])),
+		(payload.get('sid'), refresh_expires_at)
+	]
+	revoked = [(jti, expires_at) for jti, expires_at in revoked if jti]
+	for jti, expires_at in revoked:
+		RevokedToken.revoke(jti, expires_at)
+	db.session.commit()
+	for jti, _ in revoked:
+		revocations.remember(jti)
 	response_object = {
 		'status': 'success',
 		'message': 'Successfully logged out.'
@@ -109,15 +188,35 @@ def logout_user(resp):
 @auth_blueprint.route('/auth/status', methods=['GET'])
 @authenticate
 def get_user_status(resp):
-	user = User.query.filter_by(id=resp).first()
+	user = get_current_user(resp)
+	if not user:
+		# deleted after this access token was issued
+		response_object = {
+			'status': 'error',
+			'message': 'Something went wrong. Please contact us.'
+		}
+		return jsonify(response_object), 401
+	response_object = {
+		'status': 'success',
+		'data': USER_STATUS_SCHEMA.dump(user)
+	}
+	return jsonify(response_object), 200
+
+@auth_blueprint.route('/auth/stats', methods=['GET'])
+@authenticate
+def get_auth_stats(resp):
+	if not is_admin(resp):
+		response_object = {
+			'status': 'error',
+			'message': 'You do not have permission to do that.'
+		}
+		return jsonify(response_object), 401
 	response_object = {
 		'status': 'success',
 		'data': {
-			'id': user.id,
-			'username': user.username,
-			'email': user.email,
-			'active': user.active,
-			'created_at': user.created_at,
+			'token_cache': token_cache.stats(),
+			'principal_cache': principal_cache.stats(),
+			'db_pool': pool_stats(db.engine)
 		}
 	}
 	return jsonify(response_object), 200
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from werkzeug.utils import import_string
+
+
+class LocalCache:
+    """In-process LRU cache whose entries expire after a TTL"""
+
+    def __init__(self, max_size=1024, ttl=60, **kwargs):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+
+class RedisCache:
+    """Cache shared by every worker through Redis
+
+    Needs the optional `redis` package. Values are stored as JSON, so tuples
+    come back as lists.
+    """
+
+    def __init__(self, url, ttl=60, prefix='', **kwargs):
+        import redis
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self._client = redis.StrictRedis.from_url(url)
+
+    def get(self, key):
+        value = self._client.get(self.prefix + str(key))
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(value.decode())
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self._client.set(
+            self.prefix + str(key), json.dumps(value),
+            px=max(1, int(ttl * 1000)))
+
+    def delete(self, key):
+        self._client.delete(self.prefix + str(key))
+
+    def clear(self):
+        for key in self._client.scan_iter(self.prefix + '*'):
+            self._client.delete(key)
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': None,
+            'max_size': None,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+
+class Cache:
+    """Flask extension around a cache backend chosen by configuration
+
+    For a `config_prefix` of FOO it reads FOO_BACKEND (import path of the
+    backend class), FOO_MAX_SIZE, FOO_TTL and FOO_URL.
+    """
+
+    def __init__(self, config_prefix):
+        self.config_prefix = config_prefix
+        self.backend = None
+
+    def init_app(self, app):
+        prefix = self.config_prefix
+        backend = import_string(app.config.get(prefix + '_BACKEND'))
+        self.backend = backend(
+            max_size=app.config.get(prefix + '_MAX_SIZE'),
+            ttl=app.config.get(prefix + '_TTL'),
+            url=app.config.get(prefix + '_URL'),
+            prefix=prefix.lower() + ':'
+        )
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.backend.set(key, value, ttl)
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return self.backend.stats()
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import flask_bcrypt
+from werkzeug.utils import import_string
+
+from project.api.metrics import BCRYPT_DURATION
+
+
+class HashingUnavailable(Exception):
+    """Raised when every bcrypt slot is taken"""
+
+
+class PasswordHasher:
+    """Runs bcrypt on a bounded pool of worker processes
+
+    BCRYPT_POOL_SIZE processes hash at once and up to BCRYPT_POOL_QUEUE_SIZE
+    more calls may wait for them; past that `HashingUnavailable` is raised
+    after BCRYPT_POOL_TIMEOUT seconds, so a burst of logins can not tie up
+    every request worker. A pool size of 0 hashes inline.
+
+    BCRYPT_EXECUTOR names the executor class; bcrypt releases the GIL, so a
+    native thread pool works too where processes do not fit (e.g. gevent).
+
+    Work that must not hold up a response, like upgrading a hash to a new
+    cost, goes through `defer` to a single background thread. At most
+    BCRYPT_DEFER_QUEUE_SIZE such calls wait for it, and it hashes with
+    `wait=False`, so it never takes a slot a request is waiting for.
+    """
+
+    def __init__(self):
+        self.pool_size = 0
+        self.timeout = 0
+        self.retry_after = 1
+        self.executor_class = None
+        self._slots = None
+        self._executor = None
+        self._pid = None
+        self._background = None
+        self._background_pid = None
+        self.defer_queue_size = 0
+        self._pending = 0
+        self._pending_keys = set()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        pool_size = app.config.get('BCRYPT_POOL_SIZE')
+        self.shutdown()
+        self.pool_size = os.cpu_count() if pool_size is None else pool_size
+        self.timeout = app.config.get('BCRYPT_POOL_TIMEOUT')
+        self.retry_after = app.config.get('BCRYPT_RETRY_AFTER')
+        self.defer_queue_size = app.config.get('BCRYPT_DEFER_QUEUE_SIZE')
+        self.executor_class = import_string(
+            app.config.get('BCRYPT_EXECUTOR'))
+        self._slots = threading.BoundedSemaphore(
+            self.pool_size + app.config.get('BCRYPT_POOL_QUEUE_SIZE'))
+
+    def generate_password_hash(self, password, rounds, wait=True):
+        """Hashes `password`; with `wait=False` only if a slot is free now"""
+        with BCRYPT_DURATION.labels('hash').time():
+            return self._run(
+                flask_bcrypt.generate_password_hash, password, rounds,
+                timeout=self.timeout if wait else 0
+            ).decode()
+
+    def check_password_hash(self, pw_hash, password):
+        with BCRYPT_DURATION.labels('check').time():
+            return self._run(
+                flask_bcrypt.check_password_hash, pw_hash, password)
+
+    def generate_password_hashes(self, passwords, rounds):
+        """Hashes many passwords, on up to half of the pool processes
+
+        Each hash takes a slot like a single one does, so logins queue behind
+        a few of them rather than the whole list, and a saturated pool
+        raises `HashingUnavailable` part way through.
+        """
+        with BCRYPT_DURATION.labels('hash_many').time():
+            pw_hashes = self._map(
+                flask_bcrypt.generate_password_hash,
+                passwords, [rounds] * len(passwords))
+        return [pw_hash.decode() for pw_hash in pw_hashes]
+
+    @staticmethod
+    def needs_rehash(pw_hash, rounds):
+        """Whether `pw_hash` was made at a bcrypt cost other than `rounds`"""
+        # $2b$12$<salt and checksum>
+        try:
+            return int(pw_hash.split('$')[2]) != rounds
+        except (AttributeError, IndexError, ValueError):
+            return False
+
+    def defer(self, fn, *args, key=None):
+        """Runs `fn` on the background thread, or inline with no pool
+
+        The call is dropped while BCRYPT_DEFER_QUEUE_SIZE calls are pending
+        or one with the same `key` is, so `fn` must be safe to skip.
+
+        :return: whether `fn` was run or queued
+        """
+        if not self.pool_size:
+            fn(*args)
+            return True
+        with self._lock:
+            if self._background is None or self._background_pid != os.getpid():
+                self._background = ThreadPoolExecutor(1)
+                self._background_pid = os.getpid()
+                self._pending = 0
+                self._pending_keys = set()
+            if (self._pending >= self.defer_queue_size or
+                    key in self._pending_keys):
+                return False
+            self._pending += 1
+            if key is not None:
+                self._pending_keys.add(key)
+            self._background.submit(self._run_deferred, fn, args, key)
+        return True
+
+    def _run_deferred(self, fn, args, key):
+        try:
+            fn(*args)
+        finally:
+            with self._lock:
+                # the counts start over when the pool is shut down
+                self._pending = max(0, self._pending - 1)
+                self._pending_keys.discard(key)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown()
+            self._executor = None
+            background = self._background
+            if self._background_pid != os.getpid():
+                background = None
+            self._background = None
+            self._pending = 0
+            self._pending_keys = set()
+        # outside the lock, which finishing deferred calls take
+        if background is not None:
+            background.shutdown()
+
+    def _run(self, fn, *args, timeout=None):
+        if not self.pool_size:
+            return fn(*args)
+        if timeout is None:
+            timeout = self.timeout
+        if not self._slots.acquire(timeout=timeout):
+            raise HashingUnavailable()
+        try:
+            return self._get_executor().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def _map(self, fn, *iterables):
+        if not self.pool_size:
+            return list(map(fn, *iterables))
+        # the rest of the pool stays free for interactive work
+        lanes = max(1, self.pool_size // 2)
+        executor = self._get_executor()
+        results = []
+        in_flight = deque()
+        try:
+            for args in zip(*iterables):
+                if len(in_flight) >= lanes:
+                    results.append(in_flight[0].result())
+                    in_flight.popleft()
+                    self._slots.release()
+                if not self._slots.acquire(timeout=self.timeout):
+                    raise HashingUnavailable()
+                in_flight.append(executor.submit(fn, *args))
+            while in_flight:
+                results.append(in_flight[0].result())
+                in_flight.popleft()
+                self._slots.release()
+            return results
+        finally:
+            # slots of calls still running are only free once they finish
+            for future in in_flight:
+                future.exception()
+                self._slots.release()
+
+    def _get_executor(self):
+        # a pool does not survive fork, so each worker process builds its own
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = self.executor_class(self.pool_size)
+                self._pid = os.getpid()
+            return self._executor
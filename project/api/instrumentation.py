@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+logger = logging.getLogger('project.sql')
+
+# collectors opened with `count_queries`, fed from every thread
+_collectors = []
+_collectors_lock = threading.Lock()
+
+
+class QueryStats:
+    """Statement count, total DB time and slowest statement"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.slowest = 0.0
+        self.slowest_statement = None
+        self.statements = []
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        self.statements.append(statement)
+        if duration >= self.slowest:
+            self.slowest = duration
+            self.slowest_statement = statement
+
+
+@contextmanager
+def count_queries():
+    """Collects every statement run on any engine while the block runs"""
+    stats = QueryStats()
+    with _collectors_lock:
+        _collectors.append(stats)
+    try:
+        yield stats
+    finally:
+        with _collectors_lock:
+            _collectors.remove(stats)
+
+
+class QueryInstrumentation:
+    """Per-request SQL statistics from SQLAlchemy engine events
+
+    Every request gets a `QueryStats` on `g.sql_stats`. Statements slower
+    than SQLALCHEMY_SLOW_QUERY_THRESHOLD milliseconds are logged to
+    `project.sql`, and SQLALCHEMY_SERVER_TIMING adds a Server-Timing header
+    with the request's totals.
+    """
+
+    def __init__(self):
+        self.slow_query_threshold = None
+        self.server_timing = False
+
+    def init_app(self, app):
+        self.slow_query_threshold = app.config.get(
+            'SQLALCHEMY_SLOW_QUERY_THRESHOLD')
+        self.server_timing = app.config.get('SQLALCHEMY_SERVER_TIMING')
+        if not event.contains(Engine, 'after_cursor_execute', self._after):
+            event.listen(Engine, 'before_cursor_execute', self._before)
+            event.listen(Engine, 'after_cursor_execute', self._after)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+    def _before(self, conn, cursor, statement, parameters, context,
+                executemany):
+        # kept on the statement's own context, which is dropped even when
+        # the statement fails and `_after` never runs
+        if context is not None:
+            context._query_start = time.perf_counter()
+        else:
+            conn.info['query_start'] = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context,
+               executemany):
+        if context is not None:
+            start = context._query_start
+        else:
+            start = conn.info.pop('query_start')
+        duration = time.perf_counter() - start
+        if has_app_context() and 'sql_stats' in g:
+            g.sql_stats.record(statement, duration)
+        if _collectors:
+            with _collectors_lock:
+                for stats in _collectors:
+                    stats.record(statement, duration)
+        threshold = self.slow_query_threshold
+        if threshold is not None and duration * 1000 >= threshold:
+            logger.warning(
+                'slow query (%.1f ms): %s', duration * 1000, statement)
+
+    def _start_request(self):
+        g.request_start = time.perf_counter()
+        g.sql_stats = QueryStats()
+
+    def _finish_request(self, response):
+        stats = g.get('sql_stats')
+        if self.server_timing and stats is not None:
+            elapsed = time.perf_counter() - g.request_start
+            response.headers['Server-Timing'] = (
+                f'app;dur={elapsed * 1000:.2f}, '
+                f'db;dur={stats.duration * 1000:.2f};'
+                f'desc="{stats.count} queries", '
+                f'db-slowest;dur={stats.slowest * 1000:.2f}')
+        return response
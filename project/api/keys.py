@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import hashlib
+import json
+
+
+def _b64(number, length=None):
+    data = number.to_bytes(length or (number.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+class SigningKey:
+    """One RSA or EC P-256 key of the keyring, private or public only"""
+
+    def __init__(self, kid, pem):
+        # the optional `cryptography` package is only needed for these keys
+        from cryptography.hazmat.backends import default_backend
+        from cryptography.hazmat.primitives.asymmetric import ec, rsa
+        from cryptography.hazmat.primitives.serialization import (
+            load_pem_private_key, load_pem_public_key)
+
+        if not pem.lstrip().startswith('-----BEGIN'):
+            with open(pem) as f:
+                pem = f.read()
+        self.kid = kid
+        if 'PRIVATE KEY' in pem:
+            self.private_key = load_pem_private_key(
+                pem.encode(), None, default_backend())
+            self.public_key = self.private_key.public_key()
+        else:
+            self.private_key = None
+            self.public_key = load_pem_public_key(
+                pem.encode(), default_backend())
+        numbers = self.public_key.public_numbers()
+        if isinstance(self.public_key, rsa.RSAPublicKey):
+            self.algorithm = 'RS256'
+            self.jwk = {
+                'kty': 'RSA',
+                'n': _b64(numbers.n),
+                'e': _b64(numbers.e)
+            }
+        elif isinstance(self.public_key.curve, ec.SECP256R1):
+            self.algorithm = 'ES256'
+            self.jwk = {
+                'kty': 'EC',
+                'crv': 'P-256',
+                'x': _b64(numbers.x, 32),
+                'y': _b64(numbers.y, 32)
+            }
+        else:
+            raise ValueError(f'Unsupported key {kid}: use RSA or EC P-256.')
+        self.jwk.update(kid=kid, use='sig', alg=self.algorithm)
+
+
+class KeyRing:
+    """Flask extension holding the keys tokens are signed and verified with
+
+    JWT_KEYS lists (kid, PEM or path to a PEM file) pairs. The first one
+    must be a private key and signs every new token, with its kid in the
+    header; the others only verify, which is how keys are rotated: add the
+    new key first, and drop the old one once its tokens have expired.
+    Their public halves are published as a JWKS for other services.
+
+    Without JWT_KEYS tokens are signed with SECRET_KEY using HS256, as
+    before. Tokens without a kid are verified that way while
+    JWT_ACCEPT_SECRET_KEY is set, so sessions survive the switch.
+    """
+
+    def __init__(self):
+        self.keys = {}
+        self.signing_key = None
+        self.secret_key = None
+        self.accept_secret_key = True
+        self.jwks = {'keys': []}
+        self.jwks_etag = None
+
+    def init_app(self, app):
+        self.secret_key = app.config.get('SECRET_KEY')
+        self.accept_secret_key = app.config.get('JWT_ACCEPT_SECRET_KEY')
+        keys = [
+            SigningKey(kid, pem) for kid, pem in app.config.get('JWT_KEYS')]
+        if keys and keys[0].private_key is None:
+            raise ValueError('The first of JWT_KEYS must be a private key.')
+        self.keys = {key.kid: key for key in keys}
+        self.signing_key = keys[0] if keys else None
+        self.jwks = {'keys': [key.jwk for key in keys]}
+        self.jwks_etag = hashlib.sha256(
+            json.dumps(self.jwks, sort_keys=True).encode()).hexdigest()[:32]
+
+    def signing_args(self):
+        """(key, algorithm, headers) for `jwt.encode`"""
+        if self.signing_key is None:
+            return self.secret_key, 'HS256', None
+        key = self.signing_key
+        return key.private_key, key.algorithm, {'kid': key.kid}
+
+    def verification_args(self, header):
+        """(key, algorithms) for `jwt.decode` of a token with this header
+
+        The algorithm is pinned by the key, never taken from the token.
+        Raises KeyError for an unknown kid, or no kid without a usable
+        SECRET_KEY.
+        """
+        kid = header.get('kid')
+        if kid is None:
+            if self.secret_key is None or (
+                    not self.accept_secret_key and
+                    self.signing_key is not None):
+                raise KeyError(kid)
+            return self.secret_key, ['HS256']
+        key = self.keys[kid]
+        return key.public_key, [key.algorithm]
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+
+from flask import Blueprint, Response, current_app, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge,
+    Histogram, generate_latest, multiprocess)
+
+from project.api.pool import pool_stats
+
+
+metrics_blueprint = Blueprint('metrics', __name__)
+
+# Under gunicorn every worker writes its samples to files in
+# `prometheus_multiproc_dir` (set before the app is imported) and a scrape
+# merges them, so any worker can answer /metrics. Gauges are summed over the
+# live workers only, counters over every worker that ever ran.
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Request latency by route',
+    ['method', 'endpoint', 'status'])
+REQUESTS_IN_PROGRESS = Gauge(
+    'http_requests_in_progress', 'Requests being handled',
+    ['method', 'endpoint'], multiprocess_mode='livesum')
+BCRYPT_DURATION = Histogram(
+    'bcrypt_duration_seconds', 'bcrypt time, including the pool queue',
+    ['operation'],
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, float('inf')))
+JWT_DECODES = Counter(
+    'jwt_decode_total', 'Auth token decodes by outcome',
+    ['outcome', 'source'])
+RATELIMIT_REJECTED = Counter(
+    'ratelimit_rejected_total', 'Requests turned away by a rate limit',
+    ['rule', 'scope'])
+DB_POOL = {
+    stat: Gauge(
+        'db_pool_' + stat, 'Connection pool ' + stat.replace('_', ' '),
+        multiprocess_mode='livesum')
+    for stat in ('size', 'checked_in', 'checked_out', 'overflow')
+}
+# running totals are counters, so they survive a worker being recycled
+DB_POOL_COUNTERS = {
+    stat: Counter(
+        'db_pool_' + stat, 'Connection pool ' + stat.replace('_', ' '))
+    for stat in ('checkouts', 'timeouts', 'wait_seconds_total')
+}
+DB_POOL_WAIT_MAX = Gauge(
+    'db_pool_wait_seconds_max', 'Longest connection checkout wait',
+    multiprocess_mode='max')
+CACHE_SIZE = Gauge(
+    'cache_size', 'Cache size', ['cache'], multiprocess_mode='livesum')
+CACHE_COUNTERS = {
+    stat: Counter('cache_' + stat, 'Cache ' + stat, ['cache'])
+    for stat in ('hits', 'misses')
+}
+
+_gauges_updated = 0.0
+_totals = {}
+
+
+def _count(counter, key, total):
+    """Adds to `counter` what the running `total` gained since last time"""
+    last = _totals.get(key, 0)
+    # a total that went down started over, e.g. a cleared cache or new pool
+    counter.inc(total - last if total >= last else total)
+    _totals[key] = total
+
+
+def update_gauges():
+    """Copies the pool and cache counters of this process into gauges"""
+    global _gauges_updated
+    from project import db, principal_cache, token_cache
+    _gauges_updated = time.monotonic()
+    stats = pool_stats(db.engine)
+    for stat, gauge in DB_POOL.items():
+        if stat in stats:
+            gauge.set(stats[stat])
+    for stat, counter in DB_POOL_COUNTERS.items():
+        if stat in stats:
+            _count(counter, ('db_pool', stat), stats[stat])
+    if 'wait_seconds_max' in stats:
+        DB_POOL_WAIT_MAX.set(stats['wait_seconds_max'])
+    for name, cache in (('principal', principal_cache),
+                        ('token', token_cache)):
+        stats = cache.stats()
+        if stats.get('size') is not None:
+            CACHE_SIZE.labels(name).set(stats['size'])
+        for stat, counter in CACHE_COUNTERS.items():
+            if stats.get(stat) is not None:
+                _count(counter.labels(name), (name, stat), stats[stat])
+
+
+def _labels():
+    return request.method, request.endpoint or 'none'
+
+
+@metrics_blueprint.before_app_request
+def start_timer():
+    g.metrics_start = time.perf_counter()
+    REQUESTS_IN_PROGRESS.labels(*_labels()).inc()
+
+
+@metrics_blueprint.after_app_request
+def record_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+@metrics_blueprint.teardown_app_request
+def record_request(exc):
+    start = g.pop('metrics_start', None)
+    if start is None:
+        return
+    method, endpoint = _labels()
+    REQUESTS_IN_PROGRESS.labels(method, endpoint).dec()
+    REQUEST_LATENCY.labels(
+        method, endpoint, g.pop('metrics_status', 500)
+    ).observe(time.perf_counter() - start)
+    # pool and cache counters live in this process; copy them now and then
+    # rather than on every request
+    interval = current_app.config.get('METRICS_GAUGE_INTERVAL')
+    if time.monotonic() - _gauges_updated >= interval:
+        update_gauges()
+
+
+@metrics_blueprint.route('/metrics', methods=['GET'])
+def metrics():
+    update_gauges()
+    if 'prometheus_multiproc_dir' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(
+        generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
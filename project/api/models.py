@@ -1,9 +1,17 @@
 
 import datetime
+import hashlib
+import time
+import uuid
 import jwt
 
 from flask import current_app
-from project import db, bcrypt
+from sqlalchemy import update
+from sqlalchemy.orm import Session, object_session
+from sqlalchemy.dialects.postgresql import insert
+from project import (
+    db, hasher, keyring, principal_cache, revocations, token_cache)
+from project.api.metrics import JWT_DECODES
 
 
 class User(db.Model):
@@ -15,48 +23,241 @@ class User(db.Model):
     active = db.Column(db.Boolean(), default=True, nullable=False)
     admin = db.Column(db.Boolean(), default=False, nullable=False)
     created_at = db.Column(db.DateTime, nullable=False)
+    updated_at = db.Column(
+        db.DateTime, nullable=False, default=datetime.datetime.utcnow,
+        onupdate=datetime.datetime.utcnow,
+        server_default=db.text("(now() at time zone 'utc')"))
+    # bumped on every ORM update, used to build the ETag of a user
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+
+    __mapper_args__ = {
+        'version_id_col': version
+    }
+
+    __table_args__ = (
+        # keyset pagination walks (created_at, id) in descending order
+        db.Index('ix_users_created_at_id', 'created_at', 'id'),
+        # the pg_trgm indexes behind /users/search only exist in migrations
+    )
 
     def __init__(
             self, username, email, password,
             created_at = datetime.datetime.utcnow()):
         self.username = username
-        self.email = email
-        self.password = bcrypt.generate_password_hash(
-            password, current_app.config.get('BCRYPT_LOG_ROUNDS')
-        ).decode()
+        self.email = User.normalize_email(email)
+        self.password = hasher.generate_password_hash(
+            password, current_app.config.get('BCRYPT_LOG_ROUNDS'))
         self.created_at = created_at
 
-    def encode_auth_token(self, user_id):
-        """Generates the auth token"""
-        try:
-            payload = {
-                'exp': datetime.datetime.utcnow() + datetime.timedelta(
-                    days=current_app.config.get('TOKEN_EXPIRATION_DAYS'),
-                    seconds=current_app.config.get('TOKEN_EXPIRATION_SECONDS')
-                ),
-                'iat': datetime.datetime.utcnow(),
-                'sub': user_id
-            }
-            return jwt.encode(
-                payload,
-                current_app.config.get('SECRET_KEY'),
-                algorithm='HS256'
-            )
-        except Exception as e:
-            raise e
+    @staticmethod
+    def normalize_email(email):
+        """Emails are stored and compared trimmed and lower-cased"""
+        if isinstance(email, str):
+            return email.strip().lower()
+        return email
+
+    @classmethod
+    def by_email(cls, email):
+        """Query matching `email` through the unique lower(email) index"""
+        return cls.query.filter(
+            db.func.lower(cls.email) == cls.normalize_email(email))
+
+    @classmethod
+    def insert_unique(cls, username, email, password, created_at=None):
+        """Inserts a user unless the username or email is already taken
+
+        A single INSERT ... ON CONFLICT DO NOTHING, so concurrent signups for
+        the same username or email can not both succeed. The caller commits.
+
+        :return: integer|None
+        """
+        stmt = insert(cls.__table__).values(
+            username=username,
+            email=cls.normalize_email(email),
+            password=hasher.generate_password_hash(
+                password, current_app.config.get('BCRYPT_LOG_ROUNDS')),
+            created_at=created_at or datetime.datetime.utcnow()
+        ).on_conflict_do_nothing().returning(cls.id)
+        return db.session.execute(stmt).scalar()
+
+    @classmethod
+    def rehash_password(cls, user_id, pw_hash, password):
+        """Re-hashes a password at the configured BCRYPT_LOG_ROUNDS
+
+        The row is only updated while it still holds `pw_hash`, so a password
+        changed in the meantime is never overwritten. The cost of a hash is
+        not visible to clients, so `version` and `updated_at` stay as they are.
+        Raises `HashingUnavailable` rather than wait for a busy bcrypt pool.
+
+        :return: boolean
+        """
+        new_hash = hasher.generate_password_hash(
+            password, current_app.config.get('BCRYPT_LOG_ROUNDS'), wait=False)
+        table = cls.__table__
+        result = db.session.execute(
+            update(table)
+            .where(table.c.id == user_id)
+            .where(table.c.password == pw_hash)
+            .values(password=new_hash, updated_at=table.c.updated_at))
+        db.session.commit()
+        return result.rowcount == 1
+
+    @staticmethod
+    def encode_auth_token(user_id, active=True, admin=False, sid=None):
+        """Generates a short-lived access token
+
+        It carries the user's `active` and `admin` flags, so `authenticate`
+        needs no query; a change to either reaches the token at the next
+        refresh, at most ACCESS_TOKEN_EXPIRATION_SECONDS later. `sid` is the
+        jti of the refresh token it was issued with, so revoking that ends
+        every access token of the session.
+        """
+        return User._encode_token({
+            'sub': user_id,
+            'type': 'access',
+            'active': active,
+            'admin': admin,
+            'sid': sid
+        }, datetime.timedelta(
+            seconds=current_app.config.get('ACCESS_TOKEN_EXPIRATION_SECONDS')))
+
+    @staticmethod
+    def encode_refresh_token(user_id, jti=None):
+        """Generates the long-lived token accepted by /auth/refresh"""
+        return User._encode_token({
+            'sub': user_id,
+            'type': 'refresh',
+            'jti': jti
+        }, datetime.timedelta(
+            days=current_app.config.get('TOKEN_EXPIRATION_DAYS'),
+            seconds=current_app.config.get('TOKEN_EXPIRATION_SECONDS')))
+
+    @staticmethod
+    def encode_session_tokens(user_id, active=True, admin=False):
+        """Generates an access token and the refresh token of its session
+
+        :return: (bytes, bytes)
+        """
+        sid = uuid.uuid4().hex
+        return (
+            User.encode_auth_token(user_id, active, admin, sid),
+            User.encode_refresh_token(user_id, sid))
 
     @staticmethod
-    def decode_auth_token(auth_token):
+    def _encode_token(claims, expires_in):
+        payload = dict(
+            claims,
+            exp=datetime.datetime.utcnow() + expires_in,
+            iat=datetime.datetime.utcnow())
+        payload['jti'] = payload.get('jti') or uuid.uuid4().hex
+        key, algorithm, headers = keyring.signing_args()
+        return jwt.encode(payload, key, algorithm=algorithm, headers=headers)
+
+    @staticmethod
+    def decode_auth_token(auth_token, token_type='access'):
         """Decodes the auth token
 
         :params auth_token:
 
         :return: integer|string
         """
-        try:
-            payload = jwt.decode(auth_token, current_app.config.get('SECRET_KEY'))
-            return payload['sub']
-        except jwt.ExpiredSignatureError:
+        payload = User.decode_auth_payload(auth_token, token_type)
+        if isinstance(payload, str):
+            return payload
+        return payload['sub']
+
+    @staticmethod
+    def decode_auth_payload(auth_token, token_type='access'):
+        """Decodes the auth token into its claims
+
+        Tokens that already passed verification are served from the token
+        cache, which only re-checks their expiry and revocation. Tokens
+        issued before the `type` claim existed are accepted as either type.
+
+        :params auth_token:
+        :params token_type: access|refresh
+
+        :return: dict|string
+        """
+        if isinstance(auth_token, str):
+            auth_token = auth_token.encode()
+        key = hashlib.sha256(auth_token).hexdigest()
+        payload = token_cache.get(key)
+        source = 'cache'
+        if payload is not None and int(time.time()) > payload['exp']:
+            token_cache.delete(key)
+            JWT_DECODES.labels('expired', source).inc()
             return 'Signature expired. Please log in again.'
-        except jwt.InvalidTokenError:
+        if payload is None:
+            source = 'jwt'
+            try:
+                verify_key, algorithms = keyring.verification_args(
+                    jwt.get_unverified_header(auth_token))
+                payload = jwt.decode(
+                    auth_token, verify_key, algorithms=algorithms)
+            except jwt.ExpiredSignatureError:
+                JWT_DECODES.labels('expired', source).inc()
+                return 'Signature expired. Please log in again.'
+            except (jwt.InvalidTokenError, KeyError):
+                JWT_DECODES.labels('invalid', source).inc()
+                return 'Invalid token. Please log in again.'
+            # never keep an entry past the token's own expiry
+            ttl = min(
+                payload['exp'] - time.time(),
+                current_app.config.get('TOKEN_CACHE_TTL'))
+            if ttl > 0:
+                token_cache.set(key, payload, ttl)
+        if payload.get('type', token_type) != token_type:
+            JWT_DECODES.labels('invalid', source).inc()
             return 'Invalid token. Please log in again.'
+        if revocations.is_revoked(payload.get('jti'), payload.get('sid')):
+            JWT_DECODES.labels('revoked', source).inc()
+            return 'Token revoked. Please log in again.'
+        JWT_DECODES.labels('ok', source).inc()
+        return payload
+
+
+class RevokedToken(db.Model):
+    """A token id logged out before its expiry"""
+    __tablename__ = "revoked_tokens"
+    jti = db.Column(db.String(32), primary_key=True)
+    # the row can go once the token would have expired anyway
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    revoked_at = db.Column(
+        db.DateTime, nullable=False, index=True,
+        server_default=db.text("(now() at time zone 'utc')"))
+
+    @classmethod
+    def revoke(cls, jti, expires_at):
+        """Records `jti` as revoked until `expires_at`; the caller commits"""
+        db.session.execute(insert(cls.__table__).values(
+            jti=jti, expires_at=expires_at).on_conflict_do_nothing())
+
+
+# case-insensitive uniqueness, and the index behind `User.by_email`
+db.Index('ix_users_email_lower', db.func.lower(User.email), unique=True)
+
+
+@db.event.listens_for(User, 'after_update')
+@db.event.listens_for(User, 'after_delete')
+def invalidate_principal(mapper, connection, target):
+    """Marks a changed user for `drop_changed_principals`"""
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('changed_principals', set()).add(target.id)
+
+
+@db.event.listens_for(Session, 'after_commit')
+def drop_changed_principals(session):
+    """Drops the cached (active, admin) state of users changed by a commit
+
+    Only once the change is committed: dropped at flush time, a concurrent
+    request could still read the old row and cache it again.
+    """
+    for user_id in session.info.pop('changed_principals', ()):
+        principal_cache.delete(user_id)
+
+
+@db.event.listens_for(Session, 'after_rollback')
+def forget_changed_principals(session):
+    session.info.pop('changed_principals', None)
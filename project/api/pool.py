@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import NullPool, QueuePool
+
+
+class InstrumentedPool:
+    """Pool mixin recording checkouts, checkout wait time and timeouts
+
+    The wait time includes opening a new connection when the pool has none
+    idle, which is what a request actually waits for.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = {
+            'checkouts': 0,
+            'timeouts': 0,
+            'wait_seconds_total': 0.0,
+            'wait_seconds_max': 0.0
+        }
+        self._metrics_lock = threading.Lock()
+
+    def _do_get(self):
+        start = time.monotonic()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            with self._metrics_lock:
+                self.metrics['timeouts'] += 1
+            raise
+        finally:
+            waited = time.monotonic() - start
+            with self._metrics_lock:
+                self.metrics['checkouts'] += 1
+                self.metrics['wait_seconds_total'] += waited
+                self.metrics['wait_seconds_max'] = max(
+                    self.metrics['wait_seconds_max'], waited)
+
+
+class InstrumentedQueuePool(InstrumentedPool, QueuePool):
+    pass
+
+
+class InstrumentedNullPool(InstrumentedPool, NullPool):
+    pass
+
+
+def pool_stats(engine):
+    """Checkout counters and current occupancy of an engine's pool"""
+    pool = engine.pool
+    stats = dict(getattr(pool, 'metrics', {}))
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow()
+        })
+    return stats
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+import ipaddress
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache, wraps
+
+from flask import current_app, jsonify, request
+from werkzeug.utils import import_string
+
+from project.api.metrics import RATELIMIT_REJECTED
+
+
+def sliding_window(current, previous, elapsed, limit, window):
+    """Sliding window estimate from two fixed windows
+
+    The previous window counts in proportion to how much of it still
+    overlaps the last `window` seconds. Returns (allowed, retry_after).
+    """
+    weight = 1 - elapsed / window
+    if previous * weight + current <= limit:
+        return True, 0
+    # time until one more attempt fits, once enough has slid out of view
+    if current >= limit:
+        retry_after = window - elapsed + (1 - (limit - 1) / current) * window
+    else:
+        retry_after = (
+            (1 - (limit - current - 1) / previous) * window - elapsed)
+    return False, max(1, math.ceil(retry_after))
+
+
+@lru_cache(maxsize=8)
+def _networks(proxies):
+    return tuple(
+        ipaddress.ip_network(proxy, strict=False) for proxy in proxies)
+
+
+def client_ip(remote_addr, forwarded_for, trusted_proxies):
+    """The client address, looking through X-Forwarded-For of trusted proxies
+
+    Every proxy appends the address it got the request from, so the header
+    is read from the right and the first address that is not a trusted
+    proxy wins; anything left of it may have been made up by the client.
+    Without trusted proxies the header is ignored.
+    """
+    networks = _networks(tuple(trusted_proxies))
+
+    def trusted(address):
+        try:
+            address = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(address in network for network in networks)
+
+    if not networks or not remote_addr or not trusted(remote_addr):
+        return remote_addr
+    hops = [hop.strip() for hop in (forwarded_for or '').split(',')]
+    hops = [hop for hop in hops if hop]
+    for hop in reversed(hops):
+        if not trusted(hop):
+            return hop
+    return hops[0] if hops else remote_addr
+
+
+class LocalLimiterStore:
+    """Per-process window counts per key, least recently used keys out
+
+    Each worker counts on its own, so the effective limit is multiplied by
+    the number of workers; use `RedisLimiterStore` to share the counts.
+    """
+
+    def __init__(self, max_size=10000, **kwargs):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key, limit, window):
+        now = time.time()
+        index, elapsed = divmod(now, window)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < index - 1:
+                current, previous = 0, 0
+            elif entry[0] == index - 1:
+                current, previous = 0, entry[1]
+            else:
+                current, previous = entry[1], entry[2]
+            current += 1
+            self._data[key] = (index, current, previous)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+        return sliding_window(current, previous, elapsed, limit, window)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class RedisLimiterStore:
+    """Counters shared by every worker through Redis
+
+    Needs the optional `redis` package. Each window is its own key and
+    expires once it can no longer be the previous window.
+    """
+
+    def __init__(self, url, prefix='', **kwargs):
+        import redis
+        self.prefix = prefix
+        self._client = redis.StrictRedis.from_url(url)
+
+    def hit(self, key, limit, window):
+        index, elapsed = divmod(time.time(), window)
+        key = f'{self.prefix}{key}:'
+        pipe = self._client.pipeline()
+        pipe.incr(key + str(int(index)))
+        pipe.expire(key + str(int(index)), int(window * 2))
+        pipe.get(key + str(int(index) - 1))
+        current, _, previous = pipe.execute()
+        return sliding_window(
+            current, int(previous or 0), elapsed, limit, window)
+
+    def clear(self):
+        for key in self._client.scan_iter(self.prefix + '*'):
+            self._client.delete(key)
+
+
+class RateLimiter:
+    """Flask extension throttling endpoints per client IP and per email
+
+    `limit('login')` applies RATELIMIT_LOGIN_PER_IP and
+    RATELIMIT_LOGIN_PER_EMAIL, each an (attempts, seconds) pair or None.
+    Throttled requests get a 429 before the view runs, so they cost
+    neither a query nor a bcrypt check. RATELIMIT_BACKEND names the store.
+    Behind a proxy, list it in RATELIMIT_TRUSTED_PROXIES so clients are
+    told apart by X-Forwarded-For rather than all counted as the proxy.
+    """
+
+    def __init__(self):
+        self.store = None
+
+    def init_app(self, app):
+        backend = import_string(app.config.get('RATELIMIT_BACKEND'))
+        self.store = backend(
+            max_size=app.config.get('RATELIMIT_MAX_SIZE'),
+            url=app.config.get('RATELIMIT_URL'),
+            prefix='ratelimit:'
+        )
+
+    def limit(self, name):
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                if current_app.config.get('RATELIMIT_ENABLED'):
+                    retry_after = self.check(name)
+                    if retry_after:
+                        response_object = {
+                            'status': 'error',
+                            'message': 'Too many attempts. '
+                                       'Please try again later.'
+                        }
+                        return jsonify(response_object), 429, {
+                            'Retry-After': str(retry_after)
+                        }
+                return f(*args, **kwargs)
+            return decorated_function
+        return decorator
+
+    def check(self, name):
+        """Counts this request; seconds to wait if it is over a limit"""
+        post_data = request.get_json(silent=True)
+        email = post_data.get('email') if isinstance(post_data, dict) else None
+        keys = [('ip', client_ip(
+            request.remote_addr, request.headers.get('X-Forwarded-For'),
+            current_app.config.get('RATELIMIT_TRUSTED_PROXIES')))]
+        if isinstance(email, str):
+            keys.append(('email', email.strip().lower()))
+        retry_after = 0
+        for scope, value in keys:
+            rule = current_app.config.get(
+                f'RATELIMIT_{name.upper()}_PER_{scope.upper()}')
+            if not rule:
+                continue
+            allowed, wait = self.store.hit(f'{name}:{scope}:{value}', *rule)
+            if not allowed:
+                RATELIMIT_REJECTED.labels(name, scope).inc()
+                retry_after = max(retry_after, wait)
+        return retry_after
+
+    def clear(self):
+        self.store.clear()
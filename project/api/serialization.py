@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+from operator import attrgetter
+
+from flask.json import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+class Schema:
+    """Declared fields of a representation, read with one attrgetter
+
+    `dump` works on model instances and on query rows alike, so a view can
+    select only the columns it needs and still share the schema.
+    """
+
+    def __init__(self, *fields):
+        self.fields = fields
+        self._getter = attrgetter(*fields)
+        self._subsets = {}
+
+    def only(self, fields):
+        """The schema of a subset of the fields, built once per subset"""
+        fields = tuple(fields)
+        if fields == self.fields:
+            return self
+        schema = self._subsets.get(fields)
+        if schema is None:
+            unknown = set(fields) - set(self.fields)
+            if unknown:
+                raise ValueError(f'Unknown fields: {sorted(unknown)}')
+            schema = self._subsets[fields] = Schema(*fields)
+        return schema
+
+    def dump(self, obj):
+        values = self._getter(obj)
+        if len(self.fields) == 1:
+            values = (values,)
+        return dict(zip(self.fields, values))
+
+    def dump_many(self, objs):
+        fields, getter = self.fields, self._getter
+        if len(fields) == 1:
+            return [{fields[0]: getter(obj)} for obj in objs]
+        return [dict(zip(fields, getter(obj))) for obj in objs]
+
+
+# fields a caller may project with `?fields=`
+USER_SCHEMA = Schema('id', 'username', 'email', 'created_at')
+USER_DETAIL_SCHEMA = USER_SCHEMA.only(('username', 'email', 'created_at'))
+USER_STATUS_SCHEMA = Schema('id', 'username', 'email', 'active', 'created_at')
+
+
+class FastJSONEncoder(JSONEncoder):
+    """The app's JSON encoder: orjson when it is installed, else the stdlib
+
+    Set as `app.json_encoder` (see JSON_ENCODER), so `jsonify` and
+    `flask.json.dumps` use it. Dates and datetimes are encoded as ISO 8601
+    either way. Anything orjson cannot encode exactly as the stdlib would,
+    such as non-string keys or non-ASCII text while JSON_AS_ASCII is on,
+    falls back to the stdlib encoder.
+    """
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.date)):
+            return o.isoformat()
+        return super().default(o)
+
+    def encode(self, o):
+        if orjson is None or self.indent not in (None, 2):
+            return super().encode(o)
+        option = orjson.OPT_SORT_KEYS if self.sort_keys else 0
+        if self.indent:
+            option |= orjson.OPT_INDENT_2
+        try:
+            data = orjson.dumps(o, default=self.default, option=option)
+        except orjson.JSONEncodeError:
+            return super().encode(o)
+        text = data.decode()
+        if self.ensure_ascii and len(text) != len(data):
+            return super().encode(o)
+        return text
@@ -1,13 +1,36 @@
 
-from flask import Blueprint, jsonify, request, render_template
+import datetime
+import re
+from collections import OrderedDict
+
+from flask import (
+    Blueprint, jsonify, request, render_template, current_app, json,
+    Response, stream_with_context)
 
 from project.api.models import User
-from project.api.utils import authenticate, is_admin
-from project import db
-from sqlalchemy import exc
+from project.api.serialization import USER_SCHEMA, USER_DETAIL_SCHEMA
+from project.api.utils import (
+    authenticate, is_admin, encode_cursor, decode_cursor,
+    encode_search_cursor, decode_search_cursor, escape_like)
+from project import db, hasher
+from project.api.hashing import HashingUnavailable
+from sqlalchemy import (
+    exc, tuple_, or_, and_, not_, any_, bindparam, literal)
+from werkzeug.http import http_date, parse_date, quote_etag, unquote_etag
+from sqlalchemy.dialects.postgresql import insert, ARRAY
 
 users_blueprint = Blueprint('users', __name__, template_folder='./templates')
 
+USER_FIELDS = USER_SCHEMA.fields
+CONTROL_CHARACTERS = re.compile('[\x00-\x1f\x7f-\x9f]')
+# largest value of the users.id integer column
+MAX_USER_ID = 2 ** 31 - 1
+# longest value each imported column takes
+USER_COLUMN_LENGTHS = {
+    'username': User.__table__.c.username.type.length,
+    'email': User.__table__.c.email.type.length
+}
+
 
 @users_blueprint.route('/ping', methods=['GET'])
 def ping_pong():
@@ -36,25 +59,27 @@ def add_user(resp):
     email = post_data.get('email')
     password = post_data.get('password')
     try:
-        user = User.query.filter_by(email=email).first()
-        if not user:
-            db.session.add(User(
-                username=username,
-                email=email,
-                password=password
-            ))
+        user_id = User.insert_unique(username, email, password)
+        if user_id:
             db.session.commit()
             response_object = {
                 'status': 'success',
                 'message': f'{email} was added!'
             }
             return jsonify(response_object), 201
-        else:
+        db.session.rollback()
+        # only a conflict pays for a second query, to tell the cases apart
+        if User.by_email(email).first():
             response_object = {
                 'status': 'fail',
                 'message': 'Sorry. That email already exists.'
             }
-            return jsonify(response_object), 400
+        else:
+            response_object = {
+                'status': 'fail',
+                'message': 'Invalid payload.'
+            }
+        return jsonify(response_object), 400
     except (exc.IntegrityError, ValueError) as e:
         db.session.rollback()
         response_object = {
@@ -63,47 +88,441 @@ def add_user(resp):
         }
         return jsonify(response_object), 400
 
-@users_blueprint.route('/users/<user_id>', methods=['GET'])
-def get_single_user(user_id):
-    """Get single user details"""
+@users_blueprint.route('/users/bulk', methods=['POST'])
+@authenticate
+def add_users_bulk(resp):
+    """Import a JSON array or NDJSON stream of users"""
+    if not is_admin(resp):
+        response_object = {
+            'status': 'error',
+            'message': 'You do not have permission to do that.'
+        }
+        return jsonify(response_object), 401
     response_object = {
         'status': 'fail',
-        'message': 'User does not exist'
+        'message': 'Invalid payload.'
     }
-    try:
-        user = User.query.filter_by(id=int(user_id)).first()
-        if not user:
-            return jsonify(response_object), 404
-        else:
+    if request.mimetype == 'application/x-ndjson':
+        rows = []
+        for line in request.get_data(as_text=True).splitlines():
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                rows.append(None)
+    else:
+        rows = request.get_json()
+    if not rows or not isinstance(rows, list):
+        return jsonify(response_object), 400
+    if len(rows) > current_app.config.get('USERS_BULK_MAX_ROWS'):
+        response_object['message'] = 'Too many users.'
+        return jsonify(response_object), 400
+    results = [None] * len(rows)
+    batch_size = current_app.config.get('USERS_BULK_BATCH_SIZE')
+    for start in range(0, len(rows), batch_size):
+        try:
+            import_users(rows[start:start + batch_size], start, results)
+        except HashingUnavailable:
+            if not start:
+                raise
+            # earlier batches are committed, so say which rows made it
+            done = results[:start]
             response_object = {
-                'status': 'success',
+                'status': 'error',
+                'message': 'Server busy. Please try again later.',
                 'data': {
-                    'username': user.username,
-                    'email': user.email,
-                    'created_at': user.created_at
+                    'created': sum(
+                        1 for r in done if r['status'] == 'created'),
+                    'results': done
                 }
             }
-            return jsonify(response_object), 200
+            return jsonify(response_object), 503, {
+                'Retry-After': str(hasher.retry_after)
+            }
+    response_object = {
+        'status': 'success',
+        'data': {
+            'created': sum(1 for r in results if r['status'] == 'created'),
+            'results': results
+        }
+    }
+    return jsonify(response_object), 200
+
+
+def import_users(rows, offset, results):
+    """Inserts one batch of a bulk import in a single transaction
+
+    Writes a result per row into `results`, starting at `offset`. Should
+    the batch still fail in the database, its rows are retried one by one
+    so only the offending ones are reported invalid.
+    """
+    candidates = []
+    for index, row in enumerate(rows, offset):
+        if isinstance(row, dict) and all(
+                row.get(key) and isinstance(row.get(key), str)
+                for key in ('username', 'email', 'password')) and all(
+                len(row[key]) <= length
+                for key, length in USER_COLUMN_LENGTHS.items()):
+            row = dict(row, email=User.normalize_email(row['email']))
+            candidates.append((index, row))
+        else:
+            results[index] = {
+                'index': index,
+                'status': 'invalid',
+                'message': 'Invalid payload.'
+            }
+    if not candidates:
+        return
+    # one set-based lookup for the whole batch
+    existing = db.session.query(User.username, User.email).filter(or_(
+        User.username.in_({row['username'] for _, row in candidates}),
+        db.func.lower(User.email).in_(
+            {row['email'] for _, row in candidates})
+    )).all()
+    usernames = {user.username for user in existing}
+    emails = {User.normalize_email(user.email) for user in existing}
+    new_rows = []
+    for index, row in candidates:
+        if row['username'] in usernames or row['email'] in emails:
+            results[index] = {
+                'index': index,
+                'status': 'exists',
+                'message': 'Sorry. That user already exists.'
+            }
+            continue
+        usernames.add(row['username'])
+        emails.add(row['email'])
+        new_rows.append((index, row))
+    if not new_rows:
+        return
+    pw_hashes = hasher.generate_password_hashes(
+        [row['password'] for _, row in new_rows],
+        current_app.config.get('BCRYPT_LOG_ROUNDS'))
+    created_at = datetime.datetime.utcnow()
+    values = [
+        {
+            'username': row['username'],
+            'email': row['email'],
+            'password': pw_hash,
+            'created_at': created_at
+        }
+        for (_, row), pw_hash in zip(new_rows, pw_hashes)
+    ]
+    failed = set()
+    try:
+        inserted = insert_users(values)
+    except exc.DBAPIError:
+        inserted = {}
+        for (index, _), value in zip(new_rows, values):
+            try:
+                inserted.update(insert_users([value]))
+            except exc.DBAPIError:
+                failed.add(index)
+    for index, row in new_rows:
+        if index in failed:
+            results[index] = {
+                'index': index,
+                'status': 'invalid',
+                'message': 'Invalid payload.'
+            }
+        elif row['email'] in inserted:
+            results[index] = {
+                'index': index,
+                'status': 'created',
+                'id': inserted[row['email']]
+            }
+        else:
+            results[index] = {
+                'index': index,
+                'status': 'exists',
+                'message': 'Sorry. That user already exists.'
+            }
+
+
+def insert_users(values):
+    """Inserts and commits `values`; maps the email of each new user to its id
+
+    Rows that lost a race with a concurrent insert are skipped, not failed.
+    Rolls back and re-raises if the database rejects the statement.
+    """
+    stmt = insert(User.__table__).values(values).on_conflict_do_nothing(
+    ).returning(User.id, User.email)
+    try:
+        inserted = {
+            email: user_id for user_id, email in db.session.execute(stmt)}
+        db.session.commit()
+    except exc.DBAPIError:
+        db.session.rollback()
+        raise
+    return inserted
+
+@users_blueprint.route('/users/<user_id>', methods=['GET'])
+def get_single_user(user_id):
+    """Get single user details, honouring conditional GETs"""
+    response_object = {
+        'status': 'fail',
+        'message': 'User does not exist'
+    }
+    try:
+        user_id = int(user_id)
     except ValueError:
         return jsonify(response_object), 404
+    if request.if_none_match or request.if_modified_since:
+        # the version columns are enough to answer a revalidation
+        state = db.session.query(User.version, User.updated_at).filter_by(
+            id=user_id).first()
+        if not state:
+            return jsonify(response_object), 404
+        headers = cache_headers(user_id, state.version, state.updated_at)
+        if not_modified(headers):
+            return Response(status=304, headers=headers)
+    user = User.query.filter_by(id=user_id).first()
+    if not user:
+        return jsonify(response_object), 404
+    response_object = {
+        'status': 'success',
+        'data': USER_DETAIL_SCHEMA.dump(user)
+    }
+    return jsonify(response_object), 200, cache_headers(
+        user.id, user.version, user.updated_at)
+
+
+def cache_headers(user_id, version, updated_at):
+    """Validators and caching policy for a single user representation"""
+    return {
+        'ETag': quote_etag(f'{user_id}-{version}'),
+        'Last-Modified': http_date(updated_at),
+        'Cache-Control': current_app.config.get('USERS_CACHE_CONTROL')
+    }
+
+
+def not_modified(headers):
+    """Whether the request's validators still match `headers`"""
+    if request.if_none_match:
+        etag, _ = unquote_etag(headers['ETag'])
+        return request.if_none_match.contains_weak(etag)
+    last_modified = parse_date(headers['Last-Modified'])
+    return last_modified <= request.if_modified_since
 
 @users_blueprint.route('/users', methods=['GET'])
 def get_all_users():
-    """Get all users"""
-    users = User.query.order_by(User.created_at.desc()).all()
-    users_list = []
-    for user in users:
-        user_object = {
-            'id': user.id,
-            'username': user.username,
-            'email': user.email,
-            'created_at': user.created_at
+    """Get all users, newest first, one keyset page at a time"""
+    if request.args.get('format') == 'ndjson':
+        return export_users()
+    if 'ids' in request.args:
+        return get_users_by_ids(request.args.get('ids').split(','))
+    response_object = {
+        'status': 'fail',
+        'message': 'Invalid payload.'
+    }
+    try:
+        fields = parse_fields(request.args.get('fields'))
+        limit = parse_limit(request.args.get('limit'))
+        cursor = request.args.get('cursor')
+        query = db.session.query(*user_columns(fields)).order_by(
+            User.created_at.desc(), User.id.desc())
+        if cursor:
+            query = query.filter(
+                tuple_(User.created_at, User.id) < decode_cursor(cursor))
+        # fetch one extra row to know whether there is a next page
+        users = query.limit(limit + 1).all()
+    except ValueError as e:
+        response_object['message'] = str(e)
+        return jsonify(response_object), 400
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        next_cursor = encode_cursor(users[-1].created_at, users[-1].id)
+    response_object = {
+        'status': 'success',
+        'data': {
+            'users': USER_SCHEMA.only(fields).dump_many(users),
+            'next_cursor': next_cursor
+        }
+    }
+    return jsonify(response_object), 200
+
+
+@users_blueprint.route('/users/search', methods=['GET'])
+def search_users():
+    """Find users by username or email, best matches first
+
+    Usernames starting with `q` rank first, then emails starting with it,
+    then any other username or email containing it. Within a rank results
+    are ordered by username, which with the rank is the keyset of the
+    cursor.
+    """
+    response_object = {
+        'status': 'fail',
+        'message': 'Invalid payload.'
+    }
+    q = request.args.get('q', '').strip()
+    # psycopg2 can not send a NUL, and no username or email has controls
+    if CONTROL_CHARACTERS.search(q):
+        return jsonify(response_object), 400
+    min_length = current_app.config.get('USERS_SEARCH_MIN_LENGTH')
+    if len(q) < min_length or len(q) > 128:
+        response_object['message'] = (
+            f'Search terms must be {min_length} to 128 characters long.')
+        return jsonify(response_object), 400
+    try:
+        fields = parse_fields(request.args.get('fields'))
+        limit = min(
+            parse_limit(request.args.get('limit')),
+            current_app.config.get('USERS_SEARCH_MAX_RESULTS'))
+        cursor = request.args.get('cursor')
+        if cursor:
+            cursor = decode_search_cursor(cursor)
+    except ValueError as e:
+        response_object['message'] = str(e)
+        return jsonify(response_object), 400
+    pattern = escape_like(q)
+    username_prefix = User.username.ilike(pattern + '%', escape='\\')
+    email_prefix = User.email.ilike(pattern + '%', escape='\\')
+    tiers = (
+        username_prefix,
+        and_(email_prefix, not_(username_prefix)),
+        and_(or_(
+            User.username.ilike('%' + pattern + '%', escape='\\'),
+            User.email.ilike('%' + pattern + '%', escape='\\')
+        ), not_(username_prefix), not_(email_prefix))
+    )
+    # each rank is read in username order, only until the page is full:
+    # Postgres walks the username index when a term matches most of the
+    # table, and takes the few matches of a rare one from the pg_trgm GIN
+    # indexes, so neither has to sort every matching row
+    columns = user_columns(fields + ('username',))
+    users = []
+    for index, condition in enumerate(tiers):
+        if len(users) > limit:
+            break
+        if cursor and index < cursor[0]:
+            continue
+        if cursor and index == cursor[0]:
+            condition = and_(condition, User.username > cursor[1])
+        users += db.session.query(
+            literal(index).label('rank'), *columns
+        ).filter(condition).order_by(User.username).limit(
+            limit + 1 - len(users)).all()
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        last = users[-1]
+        next_cursor = encode_search_cursor(last.rank, last.username, last.id)
+    response_object = {
+        'status': 'success',
+        'data': {
+            'users': USER_SCHEMA.only(fields).dump_many(users),
+            'next_cursor': next_cursor
+        }
+    }
+    return jsonify(response_object), 200
+
+
+@users_blueprint.route('/users/export', methods=['GET'])
+def export_users():
+    """Stream every user as newline-delimited JSON"""
+    try:
+        fields = parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        response_object = {
+            'status': 'fail',
+            'message': str(e)
+        }
+        return jsonify(response_object), 400
+    # server-side cursor, so only one batch of rows is held in memory
+    query = db.session.query(*user_columns(fields)).order_by(
+        User.created_at.desc(), User.id.desc()
+    ).execution_options(stream_results=True).yield_per(
+        current_app.config.get('USERS_EXPORT_BATCH_SIZE'))
+    schema = USER_SCHEMA.only(fields)
+
+    def generate():
+        for user in query:
+            yield json.dumps(schema.dump(user)) + '\n'
+    return Response(
+        stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@users_blueprint.route('/users/lookup', methods=['POST'])
+def lookup_users():
+    """Get many users by id in one round trip"""
+    post_data = request.get_json()
+    if not isinstance(post_data, dict):
+        response_object = {
+            'status': 'fail',
+            'message': 'Invalid payload.'
         }
-        users_list.append(user_object)
+        return jsonify(response_object), 400
+    return get_users_by_ids(post_data.get('ids'))
+
+
+def get_users_by_ids(ids):
+    """Builds the response for a batch lookup, keyed by user id
+
+    Ids that do not exist map to null and are listed under `missing`.
+    """
+    response_object = {
+        'status': 'fail',
+        'message': 'Invalid ids.'
+    }
+    try:
+        fields = parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        response_object['message'] = str(e)
+        return jsonify(response_object), 400
+    if not isinstance(ids, list):
+        return jsonify(response_object), 400
+    try:
+        ids = list(OrderedDict.fromkeys(int(user_id) for user_id in ids))
+    except (TypeError, ValueError, OverflowError):
+        return jsonify(response_object), 400
+    # users.id is an int4, which Postgres refuses to compare with larger ids
+    if not ids or not all(0 < user_id <= MAX_USER_ID for user_id in ids):
+        return jsonify(response_object), 400
+    if len(ids) > current_app.config.get('USERS_LOOKUP_MAX_IDS'):
+        response_object['message'] = 'Too many ids.'
+        return jsonify(response_object), 400
+    # a single array parameter keeps the statement text the same for any count
+    users = db.session.query(*user_columns(fields)).filter(
+        User.id == any_(bindparam('ids', ids, type_=ARRAY(db.Integer)))
+    ).all()
+    schema = USER_SCHEMA.only(fields)
+    found = {user.id: schema.dump(user) for user in users}
     response_object = {
         'status': 'success',
         'data': {
-            'users': users_list
+            'users': {str(user_id): found.get(user_id) for user_id in ids},
+            'missing': [user_id for user_id in ids if user_id not in found]
         }
     }
     return jsonify(response_object), 200
+
+def parse_fields(fields):
+    """Validates a comma separated `fields` projection"""
+    if not fields:
+        return USER_FIELDS
+    fields = tuple(field.strip() for field in fields.split(','))
+    if not all(field in USER_FIELDS for field in fields):
+        raise ValueError('Invalid fields.')
+    return fields
+
+
+def parse_limit(limit):
+    """Validates the page size, capping it at USERS_MAX_PER_PAGE"""
+    if limit is None:
+        return current_app.config.get('USERS_PER_PAGE')
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise ValueError('Invalid limit.')
+    if limit < 1:
+        raise ValueError('Invalid limit.')
+    return min(limit, current_app.config.get('USERS_MAX_PER_PAGE'))
+
+
+def user_columns(fields):
+    """Columns to SELECT for `fields`, plus the keyset columns"""
+    names = set(fields) | {'id', 'created_at'}
+    return [getattr(User, name) for name in USER_FIELDS if name in names]
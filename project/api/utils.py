@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
 
+import base64
+import datetime
+import json
 from functools import wraps
 
-from flask import request, jsonify
+from flask import request, jsonify, g
 
 from project.api.models import User
+from project import principal_cache
 
 
 def authenticate(f):
@@ -21,16 +25,94 @@ def authenticate(f):
 			code = 403
 			return jsonify(response_object), code
 		auth_token = auth_header.split(" ")[1]
-		resp = User.decode_auth_token(auth_token)
-		if isinstance(resp, str):
-			response_object['message'] = resp
+		payload = User.decode_auth_payload(auth_token)
+		if isinstance(payload, str):
+			response_object['message'] = payload
 			return jsonify(response_object), code
-		user = User.query.filter_by(id=resp).first()
-		if not user or not user.active:
+		resp = payload['sub']
+		g.current_user = None
+		g.token_payload = payload
+		if 'active' in payload:
+			# access tokens are short-lived, so their claims are trusted
+			state = (payload['active'], payload['admin'])
+		else:
+			state = principal_cache.get(resp)
+		if state is None:
+			user = User.query.filter_by(id=resp).first()
+			if not user:
+				return jsonify(response_object), code
+			state = (user.active, user.admin)
+			principal_cache.set(resp, state)
+			# keep the principal so the view can reuse this lookup
+			g.current_user = user
+		active, admin = state
+		if not active:
 			return jsonify(response_object), code
+		g.user_id = resp
+		g.user_admin = admin
 		return f(resp, *args, **kwargs)
 	return decorated_function
 
+def get_current_user(user_id):
+	"""Returns the authenticated user, loading it at most once per request"""
+	user = g.get('current_user')
+	if user is None or user.id != user_id:
+		user = User.query.filter_by(id=user_id).first()
+		g.current_user = user
+	return user
+
 def is_admin(user_id):
-	user = User.query.filter_by(id=user_id).first()
+	if g.get('user_id') == user_id:
+		return g.user_admin
+	user = get_current_user(user_id)
 	return user.admin
+
+CURSOR_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+def encode_cursor(created_at, user_id):
+	"""Builds an opaque keyset cursor pointing after the given row"""
+	raw = json.dumps([created_at.strftime(CURSOR_TIME_FORMAT), user_id])
+	return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+	"""Decodes a cursor built by `encode_cursor`
+
+	:params cursor:
+
+	:return: (datetime, integer)
+	"""
+	try:
+		created_at, user_id = json.loads(
+			base64.urlsafe_b64decode(cursor.encode()).decode())
+		return (
+			datetime.datetime.strptime(created_at, CURSOR_TIME_FORMAT),
+			int(user_id)
+		)
+	except (TypeError, ValueError, OverflowError):
+		raise ValueError('Invalid cursor.')
+
+def encode_search_cursor(rank, username, user_id):
+	"""Builds an opaque cursor pointing after the given search result"""
+	raw = json.dumps([rank, username, user_id])
+	return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_search_cursor(cursor):
+	"""Decodes a cursor built by `encode_search_cursor`
+
+	:params cursor:
+
+	:return: (integer, string, integer)
+	"""
+	try:
+		rank, username, user_id = json.loads(
+			base64.urlsafe_b64decode(cursor.encode()).decode())
+		if not isinstance(username, str):
+			raise ValueError()
+		return int(rank), username, int(user_id)
+	except (TypeError, ValueError, OverflowError):
+		raise ValueError('Invalid cursor.')
+
+def escape_like(value):
+	"""Escapes LIKE wildcards so `value` only matches itself"""
+	return (
+		value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_'))
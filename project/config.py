@@ -1,15 +1,131 @@
 import os
 
 
+def db_pool_size():
+    """DB_POOL_SIZE, or this worker's share of DB_MAX_CONNECTIONS"""
+    if 'DB_POOL_SIZE' in os.environ:
+        return int(os.environ['DB_POOL_SIZE'])
+    if 'DB_MAX_CONNECTIONS' in os.environ:
+        workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+        return max(1, int(os.environ['DB_MAX_CONNECTIONS']) // workers)
+    return 5
+
+
+def bcrypt_pool_size():
+    """BCRYPT_POOL_SIZE, or this worker's share of BCRYPT_MAX_PROCESSES
+
+    The hashing budget, one process per CPU by default, is split between
+    the WEB_CONCURRENCY workers, at least one process each. With gunicorn's
+    default of 2 * CPUs + 1 workers that is one process per worker: logins
+    hash in parallel across workers, but a bulk import hashes one password
+    at a time. Fewer workers get a larger share each.
+    """
+    if 'BCRYPT_POOL_SIZE' in os.environ:
+        return int(os.environ['BCRYPT_POOL_SIZE'])
+    budget = int(os.environ.get('BCRYPT_MAX_PROCESSES', os.cpu_count() or 1))
+    workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+    return max(1, budget // workers)
+
+
 class BaseConfig:
     """Base Configuration"""
     DEBUG = False
     TESTING = False
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # connection pool of each worker process
+    SQLALCHEMY_POOL_SIZE = db_pool_size()
+    SQLALCHEMY_MAX_OVERFLOW = int(os.environ.get(
+        'DB_MAX_OVERFLOW', 0 if 'DB_MAX_CONNECTIONS' in os.environ else 10))
+    SQLALCHEMY_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 10))
+    SQLALCHEMY_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    SQLALCHEMY_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+    # milliseconds, 0 disables it
+    SQLALCHEMY_STATEMENT_TIMEOUT = int(
+        os.environ.get('DB_STATEMENT_TIMEOUT', 0))
+    # NullPool for PgBouncer in transaction pooling mode
+    SQLALCHEMY_EXTERNAL_POOLER = os.environ.get(
+        'DB_EXTERNAL_POOLER', '0') == '1'
+    # per-request query stats in a Server-Timing header
+    SQLALCHEMY_SERVER_TIMING = os.environ.get(
+        'SQLALCHEMY_SERVER_TIMING', '0') == '1'
+    # milliseconds, statements at least this slow are logged
+    SQLALCHEMY_SLOW_QUERY_THRESHOLD = int(
+        os.environ.get('SQLALCHEMY_SLOW_QUERY_THRESHOLD', 200))
     SECRET_KEY = os.environ.get('SECRET_KEY')
+    # app.json_encoder; orjson backs it when installed
+    JSON_ENCODER = os.environ.get(
+        'JSON_ENCODER', 'project.api.serialization.FastJSONEncoder')
     BCRYPT_LOG_ROUNDS = 13
+    BCRYPT_EXECUTOR = os.environ.get(
+        'BCRYPT_EXECUTOR', 'concurrent.futures.ProcessPoolExecutor')
+    # bcrypt processes of each worker process
+    BCRYPT_POOL_SIZE = bcrypt_pool_size()
+    BCRYPT_POOL_QUEUE_SIZE = 8
+    BCRYPT_POOL_TIMEOUT = 0.05
+    BCRYPT_RETRY_AFTER = 1
+    # background rehashes waiting per worker; more are dropped
+    BCRYPT_DEFER_QUEUE_SIZE = 16
+    # signing keys as kid=PEM path pairs, newest first; HS256 with
+    # SECRET_KEY without any
+    JWT_KEYS = [
+        tuple(pair.split('=', 1))
+        for pair in os.environ.get('JWT_KEYS', '').split(',') if pair]
+    # still verify tokens signed with SECRET_KEY, issued before JWT_KEYS
+    JWT_ACCEPT_SECRET_KEY = os.environ.get(
+        'JWT_ACCEPT_SECRET_KEY', '1') == '1'
+    JWKS_MAX_AGE = 300
+    # access tokens carry the user's flags; refresh tokens live for
+    # TOKEN_EXPIRATION_DAYS/SECONDS
+    ACCESS_TOKEN_EXPIRATION_SECONDS = 900
     TOKEN_EXPIRATION_DAYS = 30
     TOKEN_EXPIRATION_SECONDS = 0
+    USERS_PER_PAGE = 50
+    USERS_MAX_PER_PAGE = 500
+    USERS_EXPORT_BATCH_SIZE = 1000
+    USERS_BULK_MAX_ROWS = 10000
+    USERS_BULK_BATCH_SIZE = 500
+    USERS_LOOKUP_MAX_IDS = 100
+    # shorter terms match too many rows to rank on every request
+    USERS_SEARCH_MIN_LENGTH = 3
+    USERS_SEARCH_MAX_RESULTS = 100
+    # clients keep single user reads but revalidate them with ETags
+    USERS_CACHE_CONTROL = 'private, no-cache'
+    # (active, admin) per user id, checked by `authenticate`
+    PRINCIPAL_CACHE_BACKEND = os.environ.get(
+        'PRINCIPAL_CACHE_BACKEND', 'project.api.cache.LocalCache')
+    PRINCIPAL_CACHE_URL = os.environ.get('PRINCIPAL_CACHE_URL')
+    PRINCIPAL_CACHE_MAX_SIZE = 10000
+    PRINCIPAL_CACHE_TTL = 30
+    # logged out token ids: seconds before other workers see a logout, and
+    # between rebuilds of the in-memory filter that drop expired ones
+    REVOCATION_SYNC_INTERVAL = 5
+    REVOCATION_REBUILD_INTERVAL = 600
+    REVOCATION_FILTER_CAPACITY = 100000
+    REVOCATION_FILTER_ERROR_RATE = 0.001
+    # claims per verified token digest, checked by `decode_auth_payload`
+    TOKEN_CACHE_BACKEND = 'project.api.cache.LocalCache'
+    TOKEN_CACHE_URL = None
+    TOKEN_CACHE_MAX_SIZE = 10000
+    TOKEN_CACHE_TTL = 300
+    # (attempts, seconds) per client IP and per email, checked before any
+    # query or bcrypt work; the local store counts per worker process
+    RATELIMIT_ENABLED = os.environ.get('RATELIMIT_ENABLED', '1') == '1'
+    RATELIMIT_BACKEND = os.environ.get(
+        'RATELIMIT_BACKEND', 'project.api.ratelimit.LocalLimiterStore')
+    RATELIMIT_URL = os.environ.get('RATELIMIT_URL')
+    RATELIMIT_MAX_SIZE = 100000
+    RATELIMIT_LOGIN_PER_IP = (30, 60)
+    RATELIMIT_LOGIN_PER_EMAIL = (10, 300)
+    RATELIMIT_REGISTER_PER_IP = (10, 3600)
+    RATELIMIT_REGISTER_PER_EMAIL = None
+    # addresses or networks of the proxies in front of the app (nginx, the
+    # load balancer); the client IP is read from their X-Forwarded-For
+    RATELIMIT_TRUSTED_PROXIES = [
+        proxy.strip() for proxy in
+        os.environ.get('RATELIMIT_TRUSTED_PROXIES', '').split(',')
+        if proxy.strip()]
+    # seconds between copies of the pool and cache counters into /metrics
+    METRICS_GAUGE_INTERVAL = 1
 
 
 class DevelopmentConfig(BaseConfig):
@@ -17,6 +133,7 @@ class DevelopmentConfig(BaseConfig):
     DEBUG = True
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
     BCRYPT_LOG_ROUNDS = 4
+    SQLALCHEMY_SERVER_TIMING = True
 
 
 class TestingConfig(BaseConfig):
@@ -25,8 +142,12 @@ class TestingConfig(BaseConfig):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_TEST_URL')
     BCRYPT_LOG_ROUNDS = 4
+    BCRYPT_POOL_SIZE = 0
+    SQLALCHEMY_STATEMENT_TIMEOUT = 5000
+    ACCESS_TOKEN_EXPIRATION_SECONDS = 3
     TOKEN_EXPIRATION_DAYS = 0
     TOKEN_EXPIRATION_SECONDS = 3
+    RATELIMIT_ENABLED = False
 
 
 class ProductionConfig(BaseConfig):
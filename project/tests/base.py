@@ -1,7 +1,11 @@
 
+from contextlib import contextmanager
+
 from flask_testing import TestCase
 
-from project import create_app, db
+from project import (
+    create_app, db, limiter, principal_cache, revocations, token_cache)
+from project.api.instrumentation import count_queries
 
 app = create_app()
 
@@ -13,9 +17,21 @@ class BaseTestCase(TestCase):
     def setUp(self):
         db.create_all()
         db.session.commit()
+        # load the revocation filter now rather than inside a test's request
+        revocations.sync()
 
     def tearDown(self):
         db.session.remove()
         db.drop_all()
-
-
+        principal_cache.clear()
+        token_cache.clear()
+        limiter.clear()
+        revocations.clear()
+
+    @contextmanager
+    def assertMaxQueries(self, count):
+        """Fails if the block runs more than `count` SQL statements"""
+        with count_queries() as stats:
+            yield stats
+        self.assertLessEqual(
+            stats.count, count, '\n'.join(stats.statements))
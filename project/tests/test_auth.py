@@ -3,7 +3,7 @@
 import json
 import time
 
-from project import db
+from project import db, hasher
 from project.api.models import User
 from project.tests.base import BaseTestCase
 from project.tests.utils import add_user
@@ -46,6 +46,24 @@ class TestAuthBlueprint(BaseTestCase):
 			self.assertIn('Sorry. That user already exists.', data['message'])
 			self.assertIn('error', data['status'])
 
+	def test_user_registration_duplicate_username(self):
+		add_user('testuser', 'user2@test.com', '123456')
+		with self.client:
+			response = self.client.post(
+				'/auth/register',
+				data=json.dumps(dict(
+					username='testuser',
+					email='user@test.com',
+					password='123456'
+				)),
+				content_type='application/json'
+			)
+			data = json.loads(response.data.decode())
+			self.assertEqual(response.status_code, 400)
+			self.assertIn('Sorry. That user already exists.', data['message'])
+			self.assertIn('error', data['status'])
+			self.assertEqual(User.query.count(), 1)
+
 	def test_user_registration_invalid_json(self):
 		with self.client:
 			response = self.client.post(
@@ -100,6 +118,58 @@ class TestAuthBlueprint(BaseTestCase):
 			self.assertTrue(response.content_type == 'application/json')
 			self.assertEqual(response.status_code, 200)
 
+	def test_registered_user_login_email_case(self):
+		with self.client:
+			add_user('user', 'user@test.com', '1234')
+			response = self.client.post(
+				'/auth/login',
+				data=json.dumps(dict(
+					email='User@Test.com',
+					password='1234'
+				)),
+				content_type='application/json'
+			)
+			data = json.loads(response.data.decode())
+			self.assertTrue(data['status'] == 'success')
+			self.assertEqual(response.status_code, 200)
+
+	def test_login_rehashes_password(self):
+		"""Ensure a hash made at another cost is upgraded on login."""
+		user = add_user('user', 'user@test.com', '1234')
+		user.password = hasher.generate_password_hash('1234', 5)
+		db.session.commit()
+		user_id, version = user.id, user.version
+		with self.client:
+			response = self.client.post(
+				'/auth/login',
+				data=json.dumps(dict(
+					email='user@test.com',
+					password='1234'
+				)),
+				content_type='application/json'
+			)
+			self.assertEqual(response.status_code, 200)
+		user = User.query.get(user_id)
+		self.assertTrue(user.password.startswith('$2b$04$'))
+		self.assertTrue(hasher.check_password_hash(user.password, '1234'))
+		self.assertEqual(user.version, version)
+
+	def test_user_registration_duplicate_email_case(self):
+		add_user('testuser2', 'user@test.com', '123456')
+		with self.client:
+			response = self.client.post(
+				'/auth/register',
+				data=json.dumps(dict(
+					username='testuser',
+					email='USER@test.com',
+					password='123456'
+				)),
+				content_type='application/json'
+			)
+			data = json.loads(response.data.decode())
+			self.assertEqual(response.status_code, 400)
+			self.assertIn('Sorry. That user already exists.', data['message'])
+
 	def test_not_registered_user_login(self):
 		with self.client:
 			response = self.client.post(
@@ -116,6 +186,113 @@ class TestAuthBlueprint(BaseTestCase):
 			self.assertTrue(response.content_type == 'application/json')
 			self.assertEqual(response.status_code, 404)
 
+	def test_refresh_token(self):
+		add_user('user', 'user@test.com', '1234')
+		with self.client:
+			resp_login = self.client.post(
+				'/auth/login',
+				data=json.dumps(dict(
+					email='user@test.com',
+					password='1234'
+				)),
+				content_type='application/json'
+			)
+			refresh_token = json.loads(
+				resp_login.data.decode())['refresh_token']
+			response = self.client.post(
+				'/auth/refresh',
+				headers=dict(Authorization='Bearer ' + refresh_token)
+			)
+			data = json.loads(response.data.decode())
+			self.assertTrue(data['status'] == 'success')
+			self.assertTrue(data['message'] == 'Successfully refreshed.')
+			self.assertEqual(response.status_code, 200)
+			response = self.client.get(
+				'/auth/status',
+				headers=dict(Authorization='Bearer ' + data['auth_token'])
+			)
+			self.assertEqual(response.status_code, 200)
+
+	def test_refresh_token_missing(self):
+		"""Ensure a missing or bare Authorization header gets a 403."""
+		for headers in ({}, dict(Authorization='Bearer')):
+			response = self.client.post('/auth/refresh', headers=headers)
+			data = json.loads(response.data.decode())
+			self.assertEqual(response.status_code, 403)
+			self.assertEqual(data['message'], 'Provide a valid refresh token.')
+
+	def test_refresh_token_is_not_an_access_token(self):
+		add_user('user', 'user@test.com', '1234')
+		with self.client:
+			resp_login = self.client.post(
+				'/auth/login',
+				data=json.dumps(dict(
+					email='user@test.com',
+					password='1234'
+				)),
+				content_type='application/json'
+			)
+			tokens = json.loads(resp_login.data.decode())
+			response = self.client.get(
+				'/auth/status',
+				headers=dict(Authorization='Bearer ' + tokens['refresh_token'])
+			)
+			self.assertEqual(response.status_code, 401)
+			response = self.client.post(
+				'/auth/refresh',
+				headers=dict(Authorization='Bearer ' + tokens['auth_token'])
+			)
+			data = json.loads(response.data.decode())
+			self.assertTrue(
+				data['message'] == 'Invalid token. Please log in again.')
+			self.assertEqual(response.status_code, 401)
+
+	def test_refresh_token_inactive(self):
+		"""Ensure deactivated users can not refresh their access token."""
+		add_user('user', 'user@test.com', '1234')
+		with self.client:
+			resp_login = self.client.post(
+				'/auth/login',
+				data=json.dumps(dict(
+					email='user@test.com',
+					password='1234'
+				)),
+				content_type='application/json'
+			)
+			refresh_token = json.loads(
+				resp_login.data.decode())['refresh_token']
+			user = User.query.filter_by(email='user@test.com').first()
+			user.active = False
+			db.session.commit()
+			response = self.client.post(
+				'/auth/refresh',
+				headers=dict(Authorization='Bearer ' + refresh_token)
+			)
+			data = json.loads(response.data.decode())
+			self.assertTrue(data['status'] == 'error')
+			self.assertEqual(response.status_code, 401)
+
+	def test_access_token_needs_no_queries(self):
+		user = add_user('user', 'user@test.com', '1234')
+		user.admin = True
+		db.session.commit()
+		with self.client:
+			resp_login = self.client.post(
+				'/auth/login',
+				data=json.dumps(dict(
+					email='user@test.com',
+					password='1234'
+				)),
+				content_type='application/json'
+			)
+			auth_token = json.loads(resp_login.data.decode())['auth_token']
+			with self.assertMaxQueries(0):
+				response = self.client.get(
+					'/auth/stats',
+					headers=dict(Authorization='Bearer ' + auth_token)
+				)
+			self.assertEqual(response.status_code, 200)
+
 	def test_valid_logout(self):
 		add_user('user', 'user@test.com', '1234')
 		with self.client:
@@ -141,6 +318,36 @@ class TestAuthBlueprint(BaseTestCase):
 			self.assertTrue(data['message'] == 'Successfully logged out.')
 			self.assertEqual(response.status_code, 200)
 
+	def test_logout_revokes_tokens(self):
+		add_user('user', 'user@test.com', '1234')
+		with self.client:
+			resp_login = self.client.post(
+				'/auth/login',
+				data=json.dumps(dict(
+					email='user@test.com',
+					password='1234'
+				)),
+				content_type='application/json'
+			)
+			tokens = json.loads(resp_login.data.decode())
+			headers = dict(Authorization='Bearer ' + tokens['auth_token'])
+			response = self.client.get('/auth/logout', headers=headers)
+			self.assertEqual(response.status_code, 200)
+			response = self.client.get('/auth/status', headers=headers)
+			data = json.loads(response.data.decode())
+			self.assertTrue(
+				data['message'] == 'Token revoked. Please log in again.')
+			self.assertEqual(response.status_code, 401)
+			# the refresh token of the same session is revoked too
+			response = self.client.post(
+				'/auth/refresh',
+				headers=dict(Authorization='Bearer ' + tokens['refresh_token'])
+			)
+			data = json.loads(response.data.decode())
+			self.assertTrue(
+				data['message'] == 'Token revoked. Please log in again.')
+			self.assertEqual(response.status_code, 401)
+
 	def test_invalid_logout_expired_token(self):
 		add_user('user', 'user@test.com', '1234')
 		with self.client:
@@ -251,6 +458,34 @@ class TestAuthBlueprint(BaseTestCase):
 				'Invalid token. Please log in again.')
 			self.assertEqual(response.status_code, 401)
 
+	def test_invalid_status_deleted(self):
+		"""Ensure a live access token of a deleted user gets a 401."""
+		add_user('user', 'user@test.com', '1234')
+		with self.client:
+			resp_login = self.client.post(
+				'/auth/login',
+				data=json.dumps(dict(
+					email='user@test.com',
+					password='1234'
+				)),
+				content_type='application/json'
+			)
+			User.query.filter_by(email='user@test.com').delete()
+			db.session.commit()
+			response = self.client.get(
+				'/auth/status',
+				headers=dict(
+					Authorization='Bearer ' + json.loads(
+						resp_login.data.decode()
+						)['auth_token']
+				)
+			)
+			data = json.loads(response.data.decode())
+			self.assertTrue(data['status'] == 'error')
+			self.assertTrue(
+				data['message'] == 'Something went wrong. Please contact us.')
+			self.assertEqual(response.status_code, 401)
+
 	def test_invalid_status_inactive(self):
 		add_user('user', 'user@test.com', '1234')
 		user = User.query.filter_by(email='user@test.com').first()
@@ -312,3 +547,59 @@ class TestAuthBlueprint(BaseTestCase):
 			self.assertTrue(
 				data['message'] == 'Something went wrong. Please contact us.')
 			self.assertEqual(response.status_code, 401)
+
+	def test_auth_stats(self):
+		add_user('user', 'user@test.com', '1234')
+		user = User.query.filter_by(email='user@test.com').first()
+		user.admin = True
+		db.session.commit()
+		with self.client:
+			resp_login = self.client.post(
+				'/auth/login',
+				data=json.dumps(dict(
+					email='user@test.com',
+					password='1234'
+				)),
+				content_type='application/json'
+			)
+			response = self.client.get(
+				'/auth/stats',
+				headers=dict(
+					Authorization='Bearer ' + json.loads(
+						resp_login.data.decode()
+						)['auth_token']
+				)
+			)
+			data = json.loads(response.data.decode())
+			self.assertTrue(data['status'] == 'success')
+			self.assertEqual(data['data']['token_cache']['size'], 1)
+			self.assertIn('hit_rate', data['data']['token_cache'])
+			self.assertIn('hit_rate', data['data']['principal_cache'])
+			self.assertTrue(data['data']['db_pool']['checkouts'])
+			self.assertIn('checked_out', data['data']['db_pool'])
+			self.assertEqual(response.status_code, 200)
+
+	def test_auth_stats_not_admin(self):
+		add_user('user', 'user@test.com', '1234')
+		with self.client:
+			resp_login = self.client.post(
+				'/auth/login',
+				data=json.dumps(dict(
+					email='user@test.com',
+					password='1234'
+				)),
+				content_type='application/json'
+			)
+			response = self.client.get(
+				'/auth/stats',
+				headers=dict(
+					Authorization='Bearer ' + json.loads(
+						resp_login.data.decode()
+						)['auth_token']
+				)
+			)
+			data = json.loads(response.data.decode())
+			self.assertTrue(data['status'] == 'error')
+			self.assertTrue(
+				data['message'] == 'You do not have permission to do that.')
+			self.assertEqual(response.status_code, 401)
@@ -0,0 +1,103 @@
+import datetime
+import json
+
+import jwt
+
+from project import db, principal_cache
+from project.api.cache import LocalCache
+from project.api.models import User
+from project.tests.base import BaseTestCase
+from project.tests.utils import add_user
+
+
+class TestLocalCache(BaseTestCase):
+    """Tests for the in-process LRU/TTL cache"""
+
+    def test_get_set(self):
+        cache = LocalCache(max_size=2, ttl=60)
+        cache.set(1, (True, False))
+        self.assertEqual(cache.get(1), (True, False))
+        self.assertIsNone(cache.get(2))
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+    def test_evicts_least_recently_used(self):
+        cache = LocalCache(max_size=2, ttl=60)
+        cache.set(1, 'a')
+        cache.set(2, 'b')
+        cache.get(1)
+        cache.set(3, 'c')
+        self.assertEqual(cache.get(1), 'a')
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(cache.get(3), 'c')
+        self.assertEqual(cache.stats()['size'], 2)
+
+    def test_expires_entries(self):
+        cache = LocalCache(max_size=2, ttl=0)
+        cache.set(1, 'a')
+        self.assertIsNone(cache.get(1))
+        cache.set(1, 'a', ttl=60)
+        self.assertEqual(cache.get(1), 'a')
+
+
+class TestPrincipalCache(BaseTestCase):
+    """Tests for the cached principal used by `authenticate`
+
+    Only tokens without `active`/`admin` claims, issued before access
+    tokens carried them, still go through the principal cache.
+    """
+
+    def legacy_headers(self, user_id):
+        auth_token = jwt.encode({
+            'exp': datetime.datetime.utcnow() + datetime.timedelta(minutes=1),
+            'iat': datetime.datetime.utcnow(),
+            'sub': user_id
+        }, self.app.config.get('SECRET_KEY'), algorithm='HS256')
+        return dict(Authorization='Bearer ' + auth_token.decode())
+
+    def test_principal_cached(self):
+        user = add_user('user', 'user@test.com', '1234')
+        with self.client:
+            response = self.client.get(
+                '/auth/status', headers=self.legacy_headers(user.id))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(principal_cache.get(user.id), (True, False))
+
+    def test_principal_not_needed_with_claims(self):
+        user = add_user('user', 'user@test.com', '1234')
+        auth_token = User.encode_auth_token(user.id)
+        with self.client:
+            response = self.client.get(
+                '/auth/status',
+                headers=dict(Authorization='Bearer ' + auth_token.decode()))
+            self.assertEqual(response.status_code, 200)
+            self.assertIsNone(principal_cache.get(user.id))
+
+    def test_principal_invalidated_on_commit(self):
+        """Ensure the cached state is kept until the change is committed."""
+        user = add_user('user', 'user@test.com', '1234')
+        principal_cache.set(user.id, (True, False))
+        user.active = False
+        db.session.flush()
+        self.assertEqual(principal_cache.get(user.id), (True, False))
+        db.session.rollback()
+        self.assertEqual(principal_cache.get(user.id), (True, False))
+        user.active = False
+        db.session.commit()
+        self.assertIsNone(principal_cache.get(user.id))
+
+    def test_principal_invalidated_on_deactivate(self):
+        user = add_user('user', 'user@test.com', '1234')
+        headers = self.legacy_headers(user.id)
+        with self.client:
+            response = self.client.get('/auth/status', headers=headers)
+            self.assertEqual(response.status_code, 200)
+            user = User.query.filter_by(email='user@test.com').first()
+            user.active = False
+            db.session.commit()
+            response = self.client.get('/auth/status', headers=headers)
+            data = json.loads(response.data.decode())
+            self.assertTrue(data['status'] == 'error')
+            self.assertEqual(response.status_code, 401)
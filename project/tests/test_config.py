@@ -1,11 +1,13 @@
 
 import unittest
 import os
+from unittest import mock
 
 from flask import current_app
 from flask_testing import TestCase
 
 from project import create_app
+from project.config import bcrypt_pool_size
 
 app = create_app()
 
@@ -27,6 +29,7 @@ class TestDevelopmentConfig(TestCase):
 			os.environ.get('DATABASE_URL')
 		)
 		self.assertTrue(app.config['BCRYPT_LOG_ROUNDS'] == 4)
+		self.assertTrue(app.config['ACCESS_TOKEN_EXPIRATION_SECONDS'] == 900)
 		self.assertTrue(app.config['TOKEN_EXPIRATION_DAYS'] == 30)
 		self.assertTrue(app.config['TOKEN_EXPIRATION_SECONDS'] == 0)
 
@@ -49,8 +52,10 @@ class TestTestingConfig(TestCase):
 			os.environ.get('DATABASE_TEST_URL')
 		)
 		self.assertTrue(app.config['BCRYPT_LOG_ROUNDS'] == 4)
+		self.assertTrue(app.config['ACCESS_TOKEN_EXPIRATION_SECONDS'] == 3)
 		self.assertTrue(app.config['TOKEN_EXPIRATION_DAYS'] == 0)
 		self.assertTrue(app.config['TOKEN_EXPIRATION_SECONDS'] == 3)
+		self.assertTrue(app.config['SQLALCHEMY_STATEMENT_TIMEOUT'] == 5000)
 
 
 class TestProductionConfig(TestCase):
@@ -66,9 +71,28 @@ class TestProductionConfig(TestCase):
 		self.assertFalse(app.config['DEBUG'])
 		self.assertFalse(app.config['TESTING'])
 		self.assertTrue(app.config['BCRYPT_LOG_ROUNDS'] == 13)
+		self.assertTrue(app.config['ACCESS_TOKEN_EXPIRATION_SECONDS'] == 900)
 		self.assertTrue(app.config['TOKEN_EXPIRATION_DAYS'] == 30)
 		self.assertTrue(app.config['TOKEN_EXPIRATION_SECONDS'] == 0)
 
 
+
+class TestBcryptPoolSize(unittest.TestCase):
+	def test_split_between_workers(self):
+		environ = {'BCRYPT_MAX_PROCESSES': '8', 'WEB_CONCURRENCY': '2'}
+		with mock.patch.dict(os.environ, environ, clear=True):
+			self.assertEqual(bcrypt_pool_size(), 4)
+		# gunicorn's default of 2 * CPUs + 1 workers
+		environ = {'BCRYPT_MAX_PROCESSES': '8', 'WEB_CONCURRENCY': '17'}
+		with mock.patch.dict(os.environ, environ, clear=True):
+			self.assertEqual(bcrypt_pool_size(), 1)
+		environ = {'BCRYPT_MAX_PROCESSES': '8'}
+		with mock.patch.dict(os.environ, environ, clear=True):
+			self.assertEqual(bcrypt_pool_size(), 8)
+		environ = {'BCRYPT_POOL_SIZE': '3', 'WEB_CONCURRENCY': '17'}
+		with mock.patch.dict(os.environ, environ, clear=True):
+			self.assertEqual(bcrypt_pool_size(), 3)
+
+
 if __name__ == '__main__':
 	unittest.main()
@@ -0,0 +1,131 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import flask_bcrypt
+
+from project import hasher
+from project.api.hashing import HashingUnavailable
+from project.tests.base import BaseTestCase
+from project.tests.utils import add_user
+
+
+class TestPasswordHasher(BaseTestCase):
+    """Tests for the bcrypt worker pool"""
+
+    def tearDown(self):
+        hasher.init_app(self.app)
+        super().tearDown()
+
+    def test_hash_in_pool(self):
+        hasher.pool_size = 1
+        hasher._slots = threading.BoundedSemaphore(1)
+        pw_hash = hasher.generate_password_hash('1234', 4)
+        self.assertTrue(flask_bcrypt.check_password_hash(pw_hash, '1234'))
+        self.assertTrue(hasher.check_password_hash(pw_hash, '1234'))
+        self.assertFalse(hasher.check_password_hash(pw_hash, '4321'))
+        hasher.shutdown()
+
+    def test_hash_many_in_pool(self):
+        hasher.pool_size = 2
+        hasher._slots = threading.BoundedSemaphore(2)
+        pw_hashes = hasher.generate_password_hashes(['1234', '4321'], 4)
+        self.assertEqual(len(pw_hashes), 2)
+        self.assertTrue(flask_bcrypt.check_password_hash(pw_hashes[0], '1234'))
+        self.assertTrue(flask_bcrypt.check_password_hash(pw_hashes[1], '4321'))
+        hasher.shutdown()
+
+    def test_hash_many_leaves_room(self):
+        """Ensure bulk hashing runs on half the pool, a slot per hash."""
+        hasher.pool_size = 4
+        hasher.executor_class = ThreadPoolExecutor
+        hasher._slots = threading.BoundedSemaphore(4)
+        lock = threading.Lock()
+        running = [0, 0]
+
+        def work(value):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+            return value * 2
+        self.assertEqual(hasher._map(work, range(8)), list(range(0, 16, 2)))
+        self.assertEqual(running[1], 2)
+        # every slot is back
+        for _ in range(4):
+            self.assertTrue(hasher._slots.acquire(blocking=False))
+        hasher._slots.release()
+        with self.assertRaises(HashingUnavailable):
+            hasher.timeout = 0.01
+            hasher._map(work, range(8))
+        hasher.shutdown()
+
+    def test_needs_rehash(self):
+        pw_hash = hasher.generate_password_hash('1234', 5)
+        self.assertFalse(hasher.needs_rehash(pw_hash, 5))
+        self.assertTrue(hasher.needs_rehash(pw_hash, 4))
+        self.assertFalse(hasher.needs_rehash('not a hash', 4))
+
+    def test_defer_in_background(self):
+        hasher.pool_size = 1
+        threads = []
+        done = threading.Event()
+        hasher.defer(
+            lambda: threads.append(threading.current_thread()) or done.set())
+        self.assertTrue(done.wait(1))
+        self.assertIsNot(threads[0], threading.current_thread())
+        hasher.shutdown()
+
+    def test_defer_bounded(self):
+        """Ensure deferred calls are dropped past the queue or per key."""
+        hasher.pool_size = 1
+        hasher.defer_queue_size = 2
+        release = threading.Event()
+        calls = []
+
+        def job(name):
+            release.wait(1)
+            calls.append(name)
+        self.assertTrue(hasher.defer(job, 'a', key=1))
+        self.assertFalse(hasher.defer(job, 'again', key=1))
+        self.assertTrue(hasher.defer(job, 'b', key=2))
+        self.assertFalse(hasher.defer(job, 'c', key=3))
+        release.set()
+        hasher.shutdown()
+        self.assertEqual(calls, ['a', 'b'])
+        self.assertTrue(hasher.defer(job, 'a', key=1))
+        hasher.shutdown()
+
+    def test_hash_without_waiting(self):
+        """Ensure `wait=False` gives up at once when every slot is busy."""
+        hasher.pool_size = 1
+        hasher.timeout = 5
+        hasher._slots = threading.BoundedSemaphore(1)
+        hasher._slots.acquire()
+        with self.assertRaises(HashingUnavailable):
+            hasher.generate_password_hash('1234', 4, wait=False)
+        hasher._slots.release()
+
+    def test_login_saturated(self):
+        """Ensure a 503 is returned when every bcrypt slot is busy."""
+        add_user('user', 'user@test.com', '1234')
+        hasher.pool_size = 1
+        hasher._slots = threading.BoundedSemaphore(1)
+        hasher._slots.acquire()
+        with self.client:
+            response = self.client.post(
+                '/auth/login',
+                data=json.dumps(dict(
+                    email='user@test.com',
+                    password='1234'
+                )),
+                content_type='application/json'
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.headers['Retry-After'], '1')
+            self.assertTrue(data['status'] == 'error')
+            self.assertIn('Server busy.', data['message'])
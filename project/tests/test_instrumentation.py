@@ -0,0 +1,97 @@
+import json
+
+from sqlalchemy import exc
+
+from project import db, sql_instrumentation
+from project.api.instrumentation import count_queries
+from project.api.models import User
+from project.tests.base import BaseTestCase
+from project.tests.utils import add_user
+
+
+class TestQueryInstrumentation(BaseTestCase):
+    """Tests for per-request SQL instrumentation"""
+
+    def login(self, email='user@test.com', password='1234'):
+        resp_login = self.client.post(
+            '/auth/login',
+            data=json.dumps(dict(email=email, password=password)),
+            content_type='application/json'
+        )
+        return dict(
+            Authorization='Bearer ' + json.loads(
+                resp_login.data.decode())['auth_token'])
+
+    def test_add_user_queries(self):
+        """Ensure admin POST /users needs one identity query and the insert."""
+        add_user('user', 'user@test.com', '1234')
+        user = User.query.filter_by(email='user@test.com').first()
+        user.admin = True
+        db.session.commit()
+        with self.client:
+            headers = self.login()
+            with self.assertMaxQueries(2):
+                response = self.client.post(
+                    '/users',
+                    data=json.dumps(dict(
+                        username='repodevs',
+                        email='repodevs@gmail.com',
+                        password='password123'
+                    )),
+                    content_type='application/json',
+                    headers=headers
+                )
+            self.assertEqual(response.status_code, 201)
+
+    def test_user_status_queries(self):
+        """Ensure /auth/status loads the user once."""
+        add_user('user', 'user@test.com', '1234')
+        with self.client:
+            headers = self.login()
+            with self.assertMaxQueries(1):
+                response = self.client.get('/auth/status', headers=headers)
+            self.assertEqual(response.status_code, 200)
+            with self.assertMaxQueries(1):
+                response = self.client.get('/auth/status', headers=headers)
+            self.assertEqual(response.status_code, 200)
+
+    def test_all_users_queries(self):
+        add_user('edi', 'edi@repodevs.com', 'password')
+        add_user('santoso', 'santoso@repodevs.com', 'password')
+        with self.assertMaxQueries(1):
+            response = self.client.get('/users')
+        self.assertEqual(response.status_code, 200)
+
+    def test_server_timing(self):
+        sql_instrumentation.server_timing = True
+        try:
+            response = self.client.get('/users')
+        finally:
+            sql_instrumentation.server_timing = False
+        self.assertIn('db;dur=', response.headers['Server-Timing'])
+        self.assertIn('desc="1 queries"', response.headers['Server-Timing'])
+
+    def test_no_server_timing_by_default(self):
+        response = self.client.get('/users')
+        self.assertNotIn('Server-Timing', response.headers)
+
+    def test_slow_query_logged(self):
+        sql_instrumentation.slow_query_threshold = 0
+        try:
+            with self.assertLogs('project.sql', level='WARNING') as logs:
+                self.client.get('/users')
+        finally:
+            sql_instrumentation.slow_query_threshold = self.app.config[
+                'SQLALCHEMY_SLOW_QUERY_THRESHOLD']
+        self.assertIn('slow query', logs.output[0])
+        self.assertIn('FROM users', logs.output[0])
+
+    def test_failed_statement(self):
+        """Ensure a failing statement leaves nothing on its connection."""
+        with db.engine.connect() as conn:
+            with self.assertRaises(exc.ProgrammingError):
+                conn.execute('SELECT * FROM no_such_table')
+            self.assertNotIn('query_start', conn.info)
+            with count_queries() as stats:
+                conn.execute('SELECT 1')
+            self.assertEqual(stats.count, 1)
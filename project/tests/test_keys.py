@@ -0,0 +1,127 @@
+import datetime
+import json
+
+import jwt
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from jwt.algorithms import RSAAlgorithm
+
+from project import keyring, token_cache
+from project.api.models import User
+from project.tests.base import BaseTestCase
+
+
+def private_pem(key):
+    return key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()).decode()
+
+
+def public_pem(key):
+    return key.public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo).decode()
+
+
+RSA_KEY = rsa.generate_private_key(65537, 2048, default_backend())
+EC_KEY = ec.generate_private_key(ec.SECP256R1(), default_backend())
+
+
+class TestKeyRing(BaseTestCase):
+    """Tests for asymmetric token signing and the JWKS endpoint"""
+
+    def use_keys(self, keys, accept_secret_key=True):
+        self.app.config['JWT_KEYS'] = keys
+        self.app.config['JWT_ACCEPT_SECRET_KEY'] = accept_secret_key
+        keyring.init_app(self.app)
+        # decoded tokens are cached, as they would be until a restart
+        token_cache.clear()
+
+    def tearDown(self):
+        self.app.config.from_object('project.config.TestingConfig')
+        keyring.init_app(self.app)
+        super().tearDown()
+
+    def test_rs256(self):
+        self.use_keys([('rsa-1', private_pem(RSA_KEY))])
+        auth_token = User.encode_auth_token(1)
+        header = jwt.get_unverified_header(auth_token)
+        self.assertEqual(header['alg'], 'RS256')
+        self.assertEqual(header['kid'], 'rsa-1')
+        self.assertEqual(User.decode_auth_token(auth_token), 1)
+
+    def test_verified_offline_from_jwks(self):
+        """Ensure a peer service can verify tokens with the published key."""
+        self.use_keys([('rsa-1', private_pem(RSA_KEY))])
+        auth_token = User.encode_auth_token(1)
+        response = self.client.get('/.well-known/jwks.json')
+        jwk = json.loads(response.data.decode())['keys'][0]
+        self.assertEqual(jwk['kid'], 'rsa-1')
+        public_key = RSAAlgorithm.from_jwk(json.dumps(jwk))
+        payload = jwt.decode(auth_token, public_key, algorithms=['RS256'])
+        self.assertEqual(payload['sub'], 1)
+
+    def test_rotation(self):
+        """Ensure tokens of a retired key verify until it is removed."""
+        self.use_keys([('rsa-1', private_pem(RSA_KEY))])
+        old_token = User.encode_auth_token(1)
+        self.use_keys([
+            ('ec-2', private_pem(EC_KEY)),
+            ('rsa-1', public_pem(RSA_KEY))
+        ])
+        new_token = User.encode_auth_token(2)
+        self.assertEqual(jwt.get_unverified_header(new_token)['alg'], 'ES256')
+        self.assertEqual(User.decode_auth_token(old_token), 1)
+        self.assertEqual(User.decode_auth_token(new_token), 2)
+        self.use_keys([('ec-2', private_pem(EC_KEY))])
+        self.assertEqual(
+            User.decode_auth_token(jwt.encode(
+                {'sub': 3, 'exp': datetime.datetime.utcnow() +
+                 datetime.timedelta(minutes=1)},
+                RSA_KEY, algorithm='RS256', headers={'kid': 'rsa-1'})),
+            'Invalid token. Please log in again.')
+
+    def test_secret_key_tokens(self):
+        """Ensure HS256 tokens from before the switch are accepted or not."""
+        auth_token = User.encode_auth_token(1)
+        self.assertNotIn('kid', jwt.get_unverified_header(auth_token))
+        self.use_keys([('rsa-1', private_pem(RSA_KEY))])
+        self.assertEqual(User.decode_auth_token(auth_token), 1)
+        self.use_keys(
+            [('rsa-1', private_pem(RSA_KEY))], accept_secret_key=False)
+        self.assertEqual(
+            User.decode_auth_token(User.encode_auth_token(1)), 1)
+        self.assertEqual(
+            User.decode_auth_token(auth_token),
+            'Invalid token. Please log in again.')
+
+    def test_no_secret_key(self):
+        """Ensure tokens without a kid are invalid without a SECRET_KEY."""
+        auth_token = User.encode_auth_token(1)
+        self.app.config['SECRET_KEY'] = None
+        self.use_keys([('rsa-1', private_pem(RSA_KEY))])
+        self.assertEqual(
+            User.decode_auth_token(auth_token),
+            'Invalid token. Please log in again.')
+
+    def test_first_key_must_sign(self):
+        with self.assertRaises(ValueError):
+            self.use_keys([('rsa-1', public_pem(RSA_KEY))])
+
+    def test_jwks_cacheable(self):
+        self.use_keys([('ec-1', private_pem(EC_KEY))])
+        response = self.client.get('/.well-known/jwks.json')
+        self.assertEqual(response.status_code, 200)
+        jwk = json.loads(response.data.decode())['keys'][0]
+        self.assertEqual(
+            (jwk['kty'], jwk['crv'], jwk['alg'], jwk['use']),
+            ('EC', 'P-256', 'ES256', 'sig'))
+        self.assertNotIn('d', jwk)
+        self.assertIn('public', response.headers['Cache-Control'])
+        self.assertIn('max-age=300', response.headers['Cache-Control'])
+        response = self.client.get(
+            '/.well-known/jwks.json',
+            headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
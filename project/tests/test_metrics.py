@@ -0,0 +1,78 @@
+import json
+
+from prometheus_client import REGISTRY, CollectorRegistry, Counter
+
+from project.api.metrics import _count
+
+from project.tests.base import BaseTestCase
+from project.tests.utils import add_user
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class TestMetrics(BaseTestCase):
+    """Tests for the /metrics endpoint"""
+
+    def test_metrics(self):
+        """Ensure /metrics serves the Prometheus text format."""
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('text/plain', response.content_type)
+        data = response.data.decode()
+        self.assertIn('http_request_duration_seconds', data)
+        self.assertIn('db_pool_checkouts_total', data)
+        self.assertIn('cache_hits_total{cache="token"}', data)
+
+    def test_request_latency(self):
+        """Ensure every request is timed under its endpoint and status."""
+        labels = dict(method='GET', endpoint='users.ping_pong', status='200')
+        before = sample('http_request_duration_seconds_count', **labels)
+        self.client.get('/ping')
+        self.client.get('/ping')
+        self.assertEqual(
+            sample('http_request_duration_seconds_count', **labels),
+            before + 2)
+        self.assertEqual(sample(
+            'http_requests_in_progress',
+            method='GET', endpoint='users.ping_pong'), 0)
+
+    def test_bcrypt_and_jwt_outcomes(self):
+        """Ensure logins time bcrypt and token decodes count outcomes."""
+        add_user('test', 'test@test.com', 'test')
+        checks = sample('bcrypt_duration_seconds_count', operation='check')
+        decoded = sample('jwt_decode_total', outcome='ok', source='jwt')
+        cached = sample('jwt_decode_total', outcome='ok', source='cache')
+        invalid = sample('jwt_decode_total', outcome='invalid', source='jwt')
+        resp_login = self.client.post(
+            '/auth/login',
+            data=json.dumps(dict(email='test@test.com', password='test')),
+            content_type='application/json'
+        )
+        headers = dict(Authorization='Bearer ' + json.loads(
+            resp_login.data.decode())['auth_token'])
+        self.client.get('/auth/status', headers=headers)
+        self.client.get('/auth/status', headers=headers)
+        self.client.get('/auth/status', headers=dict(Authorization='Bearer x'))
+        self.assertEqual(
+            sample('bcrypt_duration_seconds_count', operation='check'),
+            checks + 1)
+        self.assertEqual(
+            sample('jwt_decode_total', outcome='ok', source='jwt'),
+            decoded + 1)
+        self.assertEqual(
+            sample('jwt_decode_total', outcome='ok', source='cache'),
+            cached + 1)
+        self.assertEqual(
+            sample('jwt_decode_total', outcome='invalid', source='jwt'),
+            invalid + 1)
+
+    def test_running_totals_only_grow(self):
+        """Ensure copied totals never go down, even when one starts over."""
+        registry = CollectorRegistry()
+        counter = Counter('copied', 'Copied total', registry=registry)
+        for total in (3, 5, 2, 4):
+            _count(counter, 'test_copied', total)
+        # 3 + 2, then 2 after the reset and 2 more
+        self.assertEqual(registry.get_sample_value('copied_total'), 9)
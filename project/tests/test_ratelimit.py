@@ -0,0 +1,119 @@
+import json
+from unittest import mock
+
+from project.api.ratelimit import (
+    LocalLimiterStore, client_ip, sliding_window)
+from project.tests.base import BaseTestCase
+from project.tests.utils import add_user
+
+
+class TestRateLimiter(BaseTestCase):
+    """Tests for login and registration throttling"""
+
+    def setUp(self):
+        super().setUp()
+        # TestingConfig is loaded again for every test
+        self.app.config['RATELIMIT_ENABLED'] = True
+        # keep every request of a test inside one window
+        patcher = mock.patch('project.api.ratelimit.time')
+        self.clock = patcher.start()
+        self.clock.time.return_value = 1800
+        self.addCleanup(patcher.stop)
+
+    def login(self, email='user@test.com', password='1234'):
+        return self.client.post(
+            '/auth/login',
+            data=json.dumps(dict(email=email, password=password)),
+            content_type='application/json'
+        )
+
+    def test_sliding_window(self):
+        self.assertEqual(sliding_window(5, 0, 30, 5, 60), (True, 0))
+        # half of the previous window still counts
+        self.assertEqual(sliding_window(3, 4, 30, 5, 60), (True, 0))
+        allowed, retry_after = sliding_window(2, 8, 30, 5, 60)
+        self.assertFalse(allowed)
+        self.assertEqual(retry_after, 15)
+        allowed, retry_after = sliding_window(6, 0, 30, 5, 60)
+        self.assertFalse(allowed)
+        self.assertEqual(retry_after, 50)
+
+    def test_local_store(self):
+        store = LocalLimiterStore(max_size=2)
+        self.assertTrue(store.hit('a', 2, 60)[0])
+        self.assertTrue(store.hit('a', 2, 60)[0])
+        self.assertFalse(store.hit('a', 2, 60)[0])
+        store.hit('b', 2, 60)
+        store.hit('c', 2, 60)
+        # 'a' was the least recently used key
+        self.assertNotIn('a', store._data)
+        # two windows later nothing of the old counts is left
+        self.clock.time.return_value = 1920
+        self.assertTrue(store.hit('c', 1, 60)[0])
+
+    def test_login_per_email(self):
+        """Ensure repeated logins for one email are turned away early."""
+        add_user('user', 'user@test.com', '1234')
+        self.app.config['RATELIMIT_LOGIN_PER_EMAIL'] = (2, 60)
+        self.assertEqual(self.login(password='wrong').status_code, 404)
+        self.assertEqual(self.login(password='wrong').status_code, 404)
+        with self.assertMaxQueries(0):
+            response = self.login(email='User@test.com')
+        data = json.loads(response.data.decode())
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(int(response.headers['Retry-After']) >= 1)
+        self.assertTrue(data['status'] == 'error')
+        self.assertIn('Too many attempts.', data['message'])
+        # other accounts are still reachable from this address
+        self.assertEqual(
+            self.login(email='other@test.com').status_code, 404)
+
+    def test_register_per_ip(self):
+        """Ensure registrations are limited per client address."""
+        self.app.config['RATELIMIT_REGISTER_PER_IP'] = (1, 3600)
+        responses = [self.client.post(
+            '/auth/register',
+            data=json.dumps(dict(
+                username=f'user{i}',
+                email=f'user{i}@test.com',
+                password='1234'
+            )),
+            content_type='application/json'
+        ) for i in range(2)]
+        self.assertEqual(responses[0].status_code, 201)
+        self.assertEqual(responses[1].status_code, 429)
+
+    def test_client_ip(self):
+        proxies = ['10.0.0.0/8']
+        self.assertEqual(
+            client_ip('10.0.0.2', '1.2.3.4', []), '10.0.0.2')
+        self.assertEqual(
+            client_ip('10.0.0.2', '1.2.3.4, 10.0.0.1', proxies), '1.2.3.4')
+        # a client can not pick its address by sending the header itself
+        self.assertEqual(
+            client_ip('10.0.0.2', '9.9.9.9, 1.2.3.4', proxies), '1.2.3.4')
+        self.assertEqual(
+            client_ip('1.2.3.4', '9.9.9.9', proxies), '1.2.3.4')
+        self.assertEqual(client_ip('10.0.0.2', None, proxies), '10.0.0.2')
+
+    def test_login_per_ip_behind_proxy(self):
+        """Ensure clients behind a trusted proxy are counted apart."""
+        self.app.config['RATELIMIT_LOGIN_PER_IP'] = (1, 60)
+        self.app.config['RATELIMIT_TRUSTED_PROXIES'] = ['127.0.0.1']
+
+        def login(address):
+            return self.client.post(
+                '/auth/login',
+                data=json.dumps(dict(email='user@test.com', password='1234')),
+                content_type='application/json',
+                headers={'X-Forwarded-For': address}
+            )
+        self.assertEqual(login('1.2.3.4').status_code, 404)
+        self.assertEqual(login('5.6.7.8').status_code, 404)
+        self.assertEqual(login('1.2.3.4').status_code, 429)
+
+    def test_disabled(self):
+        self.app.config['RATELIMIT_ENABLED'] = False
+        self.app.config['RATELIMIT_LOGIN_PER_IP'] = (1, 60)
+        for _ in range(3):
+            self.assertEqual(self.login().status_code, 404)
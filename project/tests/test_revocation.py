@@ -0,0 +1,52 @@
+import datetime
+import uuid
+
+from project import db, revocations
+from project.api.models import RevokedToken
+from project.api.revocation import BloomFilter
+from project.tests.base import BaseTestCase
+
+
+class TestRevocationList(BaseTestCase):
+    """Tests for the revoked token filter"""
+
+    def revoke(self, jti, expires_in=60):
+        RevokedToken.revoke(
+            jti,
+            datetime.datetime.utcnow() + datetime.timedelta(seconds=expires_in))
+        db.session.commit()
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(1000, 0.01)
+        jtis = [uuid.uuid4().hex for _ in range(1000)]
+        for jti in jtis:
+            bloom.add(jti)
+        self.assertTrue(all(jti in bloom for jti in jtis))
+        false_positives = sum(
+            uuid.uuid4().hex in bloom for _ in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_revoked_elsewhere(self):
+        """Ensure revocations by other workers are picked up on sync."""
+        self.revoke('a' * 32)
+        # this worker has not synced since the row was written
+        self.assertFalse(revocations.is_revoked('a' * 32))
+        revocations._synced_at = float('-inf')
+        self.assertTrue(revocations.is_revoked('a' * 32))
+        self.assertFalse(revocations.is_revoked('b' * 32, None))
+
+    def test_remember(self):
+        self.revoke('a' * 32)
+        revocations.remember('a' * 32)
+        self.assertTrue(revocations.is_revoked(None, 'a' * 32))
+
+    def test_expired_pruned(self):
+        """Ensure expired revocations are deleted when the filter rebuilds."""
+        self.revoke('a' * 32, expires_in=-1)
+        self.revoke('b' * 32)
+        revocations.clear()
+        revocations.sync()
+        self.assertEqual(
+            [row.jti for row in RevokedToken.query.all()], ['b' * 32])
+        self.assertNotIn('a' * 32, revocations._filter)
+        self.assertIn('b' * 32, revocations._filter)
@@ -0,0 +1,85 @@
+import datetime
+import json
+from collections import namedtuple
+from unittest import mock
+
+from flask import json as flask_json
+
+from project.api import serialization
+from project.api.serialization import Schema, USER_SCHEMA
+from project.tests.base import BaseTestCase
+from project.tests.utils import add_user
+
+
+Row = namedtuple('Row', ['id', 'username', 'email', 'created_at'])
+CREATED_AT = datetime.datetime(2017, 6, 1, 12, 30, 15, 250)
+
+
+class TestSchema(BaseTestCase):
+    """Tests for the declared schemas"""
+
+    def test_dump(self):
+        row = Row(1, 'test', 'test@test.com', CREATED_AT)
+        self.assertEqual(USER_SCHEMA.dump(row), row._asdict())
+        self.assertEqual(
+            USER_SCHEMA.only(('email',)).dump_many([row, row]),
+            [{'email': 'test@test.com'}] * 2)
+
+    def test_only(self):
+        """Ensure subsets are built once and checked against the fields."""
+        schema = USER_SCHEMA.only(('id', 'email'))
+        self.assertIs(USER_SCHEMA.only(['id', 'email']), schema)
+        self.assertIs(USER_SCHEMA.only(USER_SCHEMA.fields), USER_SCHEMA)
+        with self.assertRaises(ValueError):
+            USER_SCHEMA.only(('id', 'password'))
+
+    def test_dump_model(self):
+        user = add_user('test', 'test@test.com', 'test', CREATED_AT)
+        self.assertEqual(Schema('username', 'email').dump(user), {
+            'username': 'test',
+            'email': 'test@test.com'
+        })
+
+
+class TestFastJSONEncoder(BaseTestCase):
+    """Tests for the app's JSON encoder"""
+
+    def dumps_both(self, obj, **kwargs):
+        """The output with orjson, when installed, and without it"""
+        fast = flask_json.dumps(obj, **kwargs)
+        with mock.patch.object(serialization, 'orjson', None):
+            return fast, flask_json.dumps(obj, **kwargs)
+
+    def test_installed(self):
+        self.assertIs(self.app.json_encoder, serialization.FastJSONEncoder)
+
+    def test_iso_datetimes(self):
+        user = add_user('test', 'test@test.com', 'test', CREATED_AT)
+        response = self.client.get(f'/users/{user.id}')
+        data = json.loads(response.data.decode())
+        self.assertEqual(
+            data['data']['created_at'], '2017-06-01T12:30:15.000250')
+        for output in self.dumps_both({'on': datetime.date(2017, 6, 1)}):
+            self.assertEqual(json.loads(output), {'on': '2017-06-01'})
+
+    def test_same_as_stdlib(self):
+        obj = {'b': [1, 2.5, None, True], 'a': {'at': CREATED_AT}}
+        for kwargs in ({}, {'indent': 2}, {'sort_keys': False}):
+            fast, stdlib = self.dumps_both(obj, **kwargs)
+            self.assertEqual(json.loads(fast), json.loads(stdlib))
+        fast, stdlib = self.dumps_both(obj)
+        self.assertLess(fast.index('"a"'), fast.index('"b"'))
+
+    def test_fallbacks(self):
+        """Ensure what orjson encodes differently goes through the stdlib."""
+        for obj in ({1: 'one'}, {'name': 'Jörg'}, [2 ** 70]):
+            fast, stdlib = self.dumps_both(obj)
+            self.assertEqual(fast, stdlib)
+        # a Flask default, so reloading TestingConfig would not restore it
+        self.addCleanup(
+            self.app.config.__setitem__, 'JSON_AS_ASCII',
+            self.app.config['JSON_AS_ASCII'])
+        self.app.config['JSON_AS_ASCII'] = False
+        self.assertEqual(
+            json.loads(flask_json.dumps({'name': 'Jörg'})),
+            {'name': 'Jörg'})
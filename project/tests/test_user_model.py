@@ -1,8 +1,9 @@
 #!/usr/bin/env python
-from project import db
+from project import db, token_cache
 from project.api.models import User
 from project.tests.base import BaseTestCase
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql
 from project.tests.utils import add_user
 
 
@@ -56,3 +57,61 @@ class TestUserModel(BaseTestCase):
         auth_token = user.encode_auth_token(user.id)
         self.assertTrue(isinstance(auth_token, bytes))
         self.assertTrue(User.decode_auth_token(auth_token), user.id)
+
+    def test_decode_auth_token_cached(self):
+        user = add_user('testuser', 'user@test.com', 'password')
+        auth_token = user.encode_auth_token(user.id)
+        self.assertEqual(User.decode_auth_token(auth_token), user.id)
+        self.assertEqual(User.decode_auth_token(auth_token), user.id)
+        stats = token_cache.stats()
+        self.assertEqual(stats['size'], 1)
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_decode_auth_token_invalid_not_cached(self):
+        self.assertEqual(
+            User.decode_auth_token(b'invalid'),
+            'Invalid token. Please log in again.')
+        self.assertEqual(token_cache.stats()['size'], 0)
+
+    def test_insert_unique(self):
+        user_id = User.insert_unique('testuser', 'user@test.com', 'test')
+        db.session.commit()
+        self.assertTrue(user_id)
+        user = User.query.get(user_id)
+        self.assertEqual(user.username, 'testuser')
+        self.assertTrue(user.active)
+        self.assertFalse(user.admin)
+        self.assertIsNone(
+            User.insert_unique('testuser', 'user2@test.com', 'test'))
+        self.assertIsNone(
+            User.insert_unique('testuser2', 'user@test.com', 'test'))
+
+    def test_rehash_password(self):
+        user = add_user('testuser', 'user@test.com', 'test')
+        user_id, pw_hash = user.id, user.password
+        self.assertTrue(User.rehash_password(user_id, pw_hash, 'test'))
+        new_hash = User.query.get(user_id).password
+        self.assertNotEqual(new_hash, pw_hash)
+        # the hash changed since it was read, so it is left alone
+        self.assertFalse(User.rehash_password(user_id, pw_hash, 'test'))
+        self.assertEqual(User.query.get(user_id).password, new_hash)
+
+    def test_email_normalized(self):
+        user = add_user('testuser', ' User@Test.com ', 'test')
+        self.assertEqual(user.email, 'user@test.com')
+        self.assertEqual(User.by_email('USER@test.com').first().id, user.id)
+
+    def test_email_lookup_uses_index(self):
+        """Ensure email lookups can be answered by the lower(email) index"""
+        add_user('testuser', 'user@test.com', 'test')
+        statement = User.by_email('User@test.com').statement.compile(
+            dialect=postgresql.dialect(),
+            compile_kwargs={'literal_binds': True})
+        # a table this small is cheaper to scan, so take that option away
+        db.session.execute('SET LOCAL enable_seqscan = off')
+        plan = '\n'.join(
+            row[0] for row in db.session.execute(f'EXPLAIN {statement}'))
+        db.session.rollback()
+        self.assertIn('Index Scan', plan)
+        self.assertIn('ix_users_email_lower', plan)
@@ -1,7 +1,13 @@
+import base64
 import json
 import datetime
+from unittest import mock
 
-from project import db
+from sqlalchemy import exc
+
+from project import db, hasher
+from project.api import users
+from project.api.hashing import HashingUnavailable
 from project.api.models import User
 from project.tests.utils import add_user
 from project.tests.base import BaseTestCase
@@ -213,6 +219,42 @@ class TestUserService(BaseTestCase):
             self.assertIn('success', data['status'])
 
 
+    def test_single_user_etag(self):
+        """Ensure get single user answers conditional requests."""
+        user = add_user('repodevs', 'repodevs@gmail.com', 'password')
+        with self.client:
+            response = self.client.get(f'/users/{user.id}')
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.headers['ETag'])
+            self.assertTrue(response.headers['Last-Modified'])
+            self.assertIn('no-cache', response.headers['Cache-Control'])
+            etag = response.headers['ETag']
+            last_modified = response.headers['Last-Modified']
+            response = self.client.get(
+                f'/users/{user.id}', headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b'')
+            self.assertEqual(response.headers['ETag'], etag)
+            response = self.client.get(
+                f'/users/{user.id}',
+                headers={'If-Modified-Since': last_modified})
+            self.assertEqual(response.status_code, 304)
+
+    def test_single_user_etag_changed(self):
+        """Ensure a changed user no longer matches its old ETag."""
+        user = add_user('repodevs', 'repodevs@gmail.com', 'password')
+        with self.client:
+            response = self.client.get(f'/users/{user.id}')
+            etag = response.headers['ETag']
+            user.username = 'edi'
+            db.session.commit()
+            response = self.client.get(
+                f'/users/{user.id}', headers={'If-None-Match': etag})
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers['ETag'], etag)
+            self.assertIn('edi', data['data']['username'])
+
     def test_single_user_no_id(self):
         """Ensure error is thrown if an id is not provided."""
         with self.client:
@@ -251,6 +293,140 @@ class TestUserService(BaseTestCase):
             self.assertIn('santoso@repodevs.com', data['data']['users'][0]['email'])
             self.assertIn('success', data['status'])
 
+    def test_all_users_pagination(self):
+        """Ensure get all users pages through users with a cursor."""
+        created = datetime.datetime.utcnow()
+        add_user('edi', 'edi@repodevs.com', 'password', created)
+        add_user('santoso', 'santoso@repodevs.com', 'password', created)
+        add_user('repodevs', 'repodevs@gmail.com', 'password')
+        with self.client:
+            response = self.client.get('/users?limit=2')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(data['data']['users']), 2)
+            self.assertIn('santoso', data['data']['users'][0]['username'])
+            self.assertIn('edi', data['data']['users'][1]['username'])
+            self.assertTrue(data['data']['next_cursor'])
+            response = self.client.get(
+                '/users?limit=2&cursor=' + data['data']['next_cursor'])
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(data['data']['users']), 1)
+            self.assertIn('repodevs', data['data']['users'][0]['username'])
+            self.assertIsNone(data['data']['next_cursor'])
+
+    def test_all_users_fields(self):
+        """Ensure get all users only returns the requested fields."""
+        add_user('edi', 'edi@repodevs.com', 'password')
+        with self.client:
+            response = self.client.get('/users?fields=username')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                data['data']['users'][0], {'username': 'edi'})
+
+    def test_all_users_invalid_fields(self):
+        """Ensure error is thrown if an unknown field is requested."""
+        with self.client:
+            response = self.client.get('/users?fields=username,password')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Invalid fields.', data['message'])
+            self.assertIn('fail', data['status'])
+
+    def test_all_users_invalid_cursor(self):
+        """Ensure error is thrown if the cursor is malformed."""
+        with self.client:
+            response = self.client.get('/users?cursor=blah')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Invalid cursor.', data['message'])
+            self.assertIn('fail', data['status'])
+            # an id too large for int()
+            cursor = base64.urlsafe_b64encode(
+                b'["2017-01-01T00:00:00.000000", 1e999]').decode()
+            response = self.client.get('/users?cursor=' + cursor)
+            self.assertEqual(response.status_code, 400)
+
+    def test_search_users(self):
+        """Ensure search ranks prefix matches before substring matches."""
+        add_user('devsmith', 'smith@example.com', 'password')
+        add_user('Devon', 'devon@example.com', 'password')
+        add_user('alice', 'alice@devs.com', 'password')
+        add_user('bob', 'devbob@example.com', 'password')
+        add_user('carol', 'carol@example.com', 'password')
+        with self.client:
+            response = self.client.get('/users/search?q=dev&limit=2')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                [user['username'] for user in data['data']['users']],
+                ['Devon', 'devsmith'])
+            response = self.client.get(
+                '/users/search?q=dev&limit=2&fields=username&cursor=' +
+                data['data']['next_cursor'])
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                data['data']['users'],
+                [{'username': 'bob'}, {'username': 'alice'}])
+            self.assertIsNone(data['data']['next_cursor'])
+            # later ranks are not read once the page is full
+            with self.assertMaxQueries(1):
+                response = self.client.get('/users/search?q=dev&limit=1')
+            self.assertEqual(response.status_code, 200)
+
+    def test_search_users_escapes_wildcards(self):
+        """Ensure LIKE wildcards in the search terms match literally."""
+        add_user('edi_dev', 'edi@repodevs.com', 'password')
+        add_user('ediXdev', 'edix@repodevs.com', 'password')
+        with self.client:
+            response = self.client.get('/users/search?q=i_d')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                [user['username'] for user in data['data']['users']],
+                ['edi_dev'])
+            response = self.client.get('/users/search?q=%25%25%25')
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['data']['users'], [])
+
+    def test_search_users_invalid(self):
+        """Ensure error is thrown for short terms or a bad cursor."""
+        with self.client:
+            response = self.client.get('/users/search?q=de')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('3 to 128 characters', data['message'])
+            self.assertIn('fail', data['status'])
+            response = self.client.get('/users/search?q=dev&cursor=blah')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Invalid cursor.', data['message'])
+            for q in ('abc%00', 'abc%0Adef'):
+                response = self.client.get('/users/search?q=' + q)
+                data = json.loads(response.data.decode())
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('Invalid payload.', data['message'])
+            cursor = base64.urlsafe_b64encode(b'[1e999, "a", 1]').decode()
+            response = self.client.get('/users/search?q=dev&cursor=' + cursor)
+            self.assertEqual(response.status_code, 400)
+
+    def test_export_users(self):
+        """Ensure users can be exported as newline-delimited JSON."""
+        created = datetime.datetime.utcnow() + datetime.timedelta(-30)
+        add_user('edi', 'edi@repodevs.com', 'password', created)
+        add_user('santoso', 'santoso@repodevs.com', 'password')
+        response = self.client.get('/users?format=ndjson&fields=id,username')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.data.decode().splitlines()
+        response.close()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(sorted(json.loads(lines[0])), ['id', 'username'])
+        self.assertIn('santoso', json.loads(lines[0])['username'])
+        self.assertIn('edi', json.loads(lines[1])['username'])
+
     def test_add_user_not_admin(self):
         add_user('user', 'user@test.com', '1234')
         with self.client:
@@ -281,3 +457,299 @@ class TestUserService(BaseTestCase):
             self.assertTrue(
                 data['message'] == 'You do not have permission to do that.')
             self.assertEqual(response.status_code, 401)
+
+    def test_add_users_bulk(self):
+        """Ensure users can be imported in bulk."""
+        add_user('user', 'user@test.com', '1234')
+        add_user('edi', 'edi@repodevs.com', 'password')
+        user = User.query.filter_by(email='user@test.com').first()
+        user.admin = True
+        db.session.commit()
+        with self.client:
+            resp_login = self.client.post(
+                '/auth/login',
+                data=json.dumps(dict(
+                    email='user@test.com',
+                    password='1234'
+                )),
+                content_type='application/json'
+            )
+            response = self.client.post(
+                '/users/bulk',
+                data=json.dumps([
+                    dict(
+                        username='repodevs',
+                        email='repodevs@gmail.com',
+                        password='password'),
+                    dict(
+                        username='edi2',
+                        email='edi@repodevs.com',
+                        password='password'),
+                    dict(username='santoso', password='password'),
+                    dict(
+                        username='repodevs',
+                        email='repodevs2@gmail.com',
+                        password='password'),
+                ]),
+                content_type='application/json',
+                headers=dict(
+                    Authorization='Bearer ' + json.loads(
+                        resp_login.data.decode()
+                        )['auth_token']
+                )
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('success', data['status'])
+            self.assertEqual(data['data']['created'], 1)
+            results = data['data']['results']
+            self.assertEqual(
+                [r['status'] for r in results],
+                ['created', 'exists', 'invalid', 'exists'])
+            user = User.query.filter_by(email='repodevs@gmail.com').first()
+            self.assertEqual(results[0]['id'], user.id)
+            self.assertTrue(user.active)
+            self.assertFalse(user.admin)
+
+    def test_add_users_bulk_invalid_rows(self):
+        """Ensure rows the database rejects fail alone, not the batch."""
+        add_user('user', 'user@test.com', '1234')
+        user = User.query.filter_by(email='user@test.com').first()
+        user.admin = True
+        db.session.commit()
+        with self.client:
+            resp_login = self.client.post(
+                '/auth/login',
+                data=json.dumps(dict(
+                    email='user@test.com',
+                    password='1234'
+                )),
+                content_type='application/json'
+            )
+            headers = dict(Authorization='Bearer ' + json.loads(
+                resp_login.data.decode())['auth_token'])
+            response = self.client.post(
+                '/users/bulk',
+                data=json.dumps([
+                    dict(username='a', email='a@test.com', password='pw'),
+                    dict(username='b' * 200, email='b@test.com', password='pw'),
+                    dict(username='c', email='c@test.com', password='pw'),
+                ]),
+                content_type='application/json',
+                headers=headers
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(
+                [r['status'] for r in data['data']['results']],
+                ['created', 'invalid', 'created'])
+            # a batch the database rejects is retried one row at a time
+            real_insert_users = users.insert_users
+
+            def insert_users(values):
+                if len(values) > 1 or values[0]['username'] == 'e':
+                    raise exc.DBAPIError('INSERT', {}, Exception())
+                return real_insert_users(values)
+            with mock.patch.object(users, 'insert_users', insert_users):
+                response = self.client.post(
+                    '/users/bulk',
+                    data=json.dumps([
+                        dict(username='d', email='d@test.com', password='pw'),
+                        dict(username='e', email='e@test.com', password='pw'),
+                        dict(username='f', email='f@test.com', password='pw'),
+                    ]),
+                    content_type='application/json',
+                    headers=headers
+                )
+            data = json.loads(response.data.decode())
+            self.assertEqual(
+                [r['status'] for r in data['data']['results']],
+                ['created', 'invalid', 'created'])
+            self.assertEqual(User.query.count(), 5)
+
+    def test_add_users_bulk_busy(self):
+        """Ensure a busy bcrypt pool still reports the committed rows."""
+        add_user('user', 'user@test.com', '1234')
+        user = User.query.filter_by(email='user@test.com').first()
+        user.admin = True
+        db.session.commit()
+        self.app.config['USERS_BULK_BATCH_SIZE'] = 1
+        with self.client:
+            resp_login = self.client.post(
+                '/auth/login',
+                data=json.dumps(dict(
+                    email='user@test.com',
+                    password='1234'
+                )),
+                content_type='application/json'
+            )
+            real_hashes = hasher.generate_password_hashes
+            calls = []
+
+            def generate_password_hashes(passwords, rounds):
+                calls.append(passwords)
+                if len(calls) > 1:
+                    raise HashingUnavailable()
+                return real_hashes(passwords, rounds)
+            with mock.patch.object(
+                    hasher, 'generate_password_hashes',
+                    generate_password_hashes):
+                response = self.client.post(
+                    '/users/bulk',
+                    data=json.dumps([
+                        dict(username='a', email='a@test.com', password='pw'),
+                        dict(username='b', email='b@test.com', password='pw'),
+                    ]),
+                    content_type='application/json',
+                    headers=dict(Authorization='Bearer ' + json.loads(
+                        resp_login.data.decode())['auth_token'])
+                )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 503)
+            self.assertIn('Retry-After', response.headers)
+            self.assertEqual(data['data']['created'], 1)
+            self.assertEqual(
+                [r['status'] for r in data['data']['results']], ['created'])
+            self.assertEqual(User.query.count(), 2)
+
+    def test_add_users_bulk_ndjson(self):
+        """Ensure users can be imported in bulk from NDJSON."""
+        add_user('user', 'user@test.com', '1234')
+        user = User.query.filter_by(email='user@test.com').first()
+        user.admin = True
+        db.session.commit()
+        with self.client:
+            resp_login = self.client.post(
+                '/auth/login',
+                data=json.dumps(dict(
+                    email='user@test.com',
+                    password='1234'
+                )),
+                content_type='application/json'
+            )
+            response = self.client.post(
+                '/users/bulk',
+                data='\n'.join([
+                    json.dumps(dict(
+                        username='repodevs',
+                        email='repodevs@gmail.com',
+                        password='password')),
+                    'blah',
+                ]),
+                content_type='application/x-ndjson',
+                headers=dict(
+                    Authorization='Bearer ' + json.loads(
+                        resp_login.data.decode()
+                        )['auth_token']
+                )
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                [r['status'] for r in data['data']['results']],
+                ['created', 'invalid'])
+            resp_login = self.client.post(
+                '/auth/login',
+                data=json.dumps(dict(
+                    email='repodevs@gmail.com',
+                    password='password'
+                )),
+                content_type='application/json'
+            )
+            self.assertEqual(resp_login.status_code, 200)
+
+    def test_add_users_bulk_not_admin(self):
+        add_user('user', 'user@test.com', '1234')
+        with self.client:
+            resp_login = self.client.post(
+                '/auth/login',
+                data=json.dumps(dict(
+                    email='user@test.com',
+                    password='1234'
+                )),
+                content_type='application/json'
+            )
+            response = self.client.post(
+                '/users/bulk',
+                data=json.dumps([]),
+                content_type='application/json',
+                headers=dict(
+                    Authorization='Bearer ' + json.loads(
+                        resp_login.data.decode()
+                        )['auth_token']
+                )
+            )
+            data = json.loads(response.data)
+            self.assertTrue(data['status'] == 'error')
+            self.assertTrue(
+                data['message'] == 'You do not have permission to do that.')
+            self.assertEqual(response.status_code, 401)
+
+    def test_lookup_users(self):
+        """Ensure many users can be fetched by id at once."""
+        edi = add_user('edi', 'edi@repodevs.com', 'password')
+        santoso = add_user('santoso', 'santoso@repodevs.com', 'password')
+        with self.client:
+            response = self.client.post(
+                '/users/lookup?fields=username',
+                data=json.dumps(dict(ids=[santoso.id, edi.id, 999])),
+                content_type='application/json'
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('success', data['status'])
+            self.assertEqual(data['data']['users'], {
+                str(edi.id): {'username': 'edi'},
+                str(santoso.id): {'username': 'santoso'},
+                '999': None
+            })
+            self.assertEqual(data['data']['missing'], [999])
+
+    def test_lookup_users_query_string(self):
+        """Ensure many users can be fetched with GET /users?ids=."""
+        edi = add_user('edi', 'edi@repodevs.com', 'password')
+        with self.client:
+            response = self.client.get(f'/users?ids={edi.id},999')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(
+                'edi@repodevs.com',
+                data['data']['users'][str(edi.id)]['email'])
+            self.assertIsNone(data['data']['users']['999'])
+
+    def test_lookup_users_invalid_ids(self):
+        """Ensure error is thrown if the ids are not integers."""
+        with self.client:
+            response = self.client.get('/users?ids=1,blah')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Invalid ids.', data['message'])
+            self.assertIn('fail', data['status'])
+
+    def test_lookup_users_ids_out_of_range(self):
+        """Ensure error is thrown for ids the id column can not hold."""
+        with self.client:
+            response = self.client.get('/users?ids=1,99999999999')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Invalid ids.', data['message'])
+            for ids in ([1, 2 ** 70], [0], [1, 1e999]):
+                response = self.client.post(
+                    '/users/lookup',
+                    data=json.dumps(dict(ids=ids)),
+                    content_type='application/json'
+                )
+                data = json.loads(response.data.decode())
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('Invalid ids.', data['message'])
+
+    def test_lookup_users_too_many_ids(self):
+        """Ensure error is thrown if too many ids are requested."""
+        with self.client:
+            response = self.client.post(
+                '/users/lookup',
+                data=json.dumps(dict(ids=list(range(1, 102)))),
+                content_type='application/json'
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Too many ids.', data['message'])
@@ -0,0 +1,34 @@
+"""Serves the users service on a gevent event loop
+
+Every request runs in its own greenlet and psycopg2 yields to the loop while
+it waits on Postgres, so one process can hold thousands of keep-alive
+clients. bcrypt runs on gevent's native thread pool, outside the loop.
+
+    $ python serve_async.py
+"""
+# patch before anything imports socket, threading or psycopg2
+from gevent import monkey
+monkey.patch_all()
+from psycogreen.gevent import patch_psycopg
+patch_psycopg()
+
+import os
+
+os.environ.setdefault(
+    'BCRYPT_EXECUTOR', 'gevent.threadpool.ThreadPoolExecutor')
+
+from gevent.pywsgi import WSGIServer
+
+from project import create_app
+
+
+app = create_app()
+
+
+if __name__ == '__main__':
+    server = WSGIServer(
+        (os.environ.get('HOST', '0.0.0.0'), int(os.environ.get('PORT', 5000))),
+        app,
+        spawn=int(os.environ.get('ASYNC_MAX_CLIENTS', 10000))
+    )
+    server.serve_forever()
@@ -0,0 +1,8 @@
+"""WSGI entry point for production servers
+
+    $ gunicorn -c gunicorn_config.py wsgi:app
+"""
+from project import create_app
+
+
+app = create_app()